@@ -0,0 +1,152 @@
+""" Measures rom name normalization throughput and how many metadata searches canonical title keys save.
+
+Usage: python benchmarks/bench_normalize.py [--names-file PATH] [--names N] [--titles N] [--seed N] [--show N]
+
+The corpus is read from --names-file: a No-Intro/TOSEC style DAT file, or a listing with one rom file name
+per line such as the output of "dir /b" in a GoodNES set. Releases of the same game are grouped by the
+parent game of a DAT (cloneof/cloneofid), and in a listing by the letters and digits of the name before
+its first tag. Groups whose names parse to different title keys are reported, they are searched more than once.
+
+Without --names-file the corpus is synthetic: GoodNES and No-Intro style names built from a set of titles with the
+region, revision, language, dump and hack tags found in real sets, several releases per title. Its cache hit rate
+only follows from --names and --titles.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+import xml.etree.ElementTree as ElementTree
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import normalize  # noqa: E402
+from archives import ARCHIVE_EXTENSIONS  # noqa: E402
+from datfile import DAT_EXTENSIONS  # noqa: E402
+from scanner import ROM_EXTENSIONS  # noqa: E402
+
+WORDS = (
+    "super", "mario", "bros", "legend", "zelda", "mega", "man", "castlevania", "metroid", "contra", "ninja",
+    "gaiden", "dragon", "warrior", "quest", "final", "fantasy", "adventure", "island", "kirby", "tetris",
+    "double", "battletoads", "punch", "out", "duck", "tales", "river", "city", "ransom", "kid", "icarus",
+)
+GOODNES_TAGS = ("(U)", "(E)", "(J)", "(UE)", "(JU)", "(W)", "(PRG0)", "(PRG1)", "[!]", "[b1]", "[a1]", "[o1]",
+    "[h1]", "[hM04]", "[T+Eng1.0]", "[T-Fre]", "[p1]", "[t1]")
+NO_INTRO_TAGS = ("(USA)", "(Europe)", "(Japan)", "(USA, Europe)", "(Rev A)", "(Rev 1)", "(En,Fr,De)",
+    "(Beta)", "(Proto)", "(Unl)", "(Hack)")
+
+
+def build_titles(count, rng):
+    titles = set()
+    while len(titles) < count:
+        words = rng.sample(WORDS, rng.randint(1, 4))
+        title = " ".join(word.capitalize() for word in words)
+        if rng.random() < 0.1:
+            title += " " + str(rng.randint(2, 6))
+        if rng.random() < 0.05:
+            title += ", The"
+        titles.add(title)
+    return sorted(titles)
+
+
+def build_names(count, titles, rng):
+    names = []
+    for _ in range(count):
+        title = rng.choice(titles)
+        if rng.random() < 0.5:
+            tags = rng.sample(GOODNES_TAGS, rng.randint(1, 3))
+        else:
+            tags = rng.sample(NO_INTRO_TAGS, rng.randint(1, 2))
+        group = title
+        if rng.random() < 0.05:
+            title = title.replace(" ", "  ").lower()
+        names.append((title + " " + " ".join(tags), group))
+    return names
+
+
+def read_dat(path):
+    names = []
+    for _, element in ElementTree.iterparse(path):
+        if element.tag not in ("game", "machine"):
+            continue
+        name = element.get("name", "")
+        if element.get("id") is not None:
+            group = element.get("cloneofid") or element.get("id")
+        else:
+            group = element.get("cloneof") or name
+        names.append((name, group))
+        element.clear()
+    return names
+
+
+def listing_group(name):
+    # Independent of parse_rom_name, so names it splits still end up in one group
+    title = re.split(r"[(\[]", name, 1)[0].lower()
+    return re.sub(r"\bthe\b|[^a-z0-9]", "", title)
+
+
+def read_listing(path):
+    names = []
+    with open(path, encoding="utf-8", errors="replace") as listing:
+        for line in listing:
+            name = os.path.basename(line.strip())
+            if not name:
+                continue
+            stem, extension = os.path.splitext(name)
+            if extension.lower() in ROM_EXTENSIONS + ARCHIVE_EXTENSIONS:
+                name = stem
+            names.append((name, listing_group(name)))
+    return names
+
+
+def read_names(path):
+    ''' Returns a list of (rom name, group of the game) from a DAT file or a listing of rom file names'''
+    if path.lower().endswith(DAT_EXTENSIONS):
+        return read_dat(path)
+    return read_listing(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--names-file")
+    parser.add_argument("--names", type=int, default=100000)
+    parser.add_argument("--titles", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--show", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.names_file:
+        corpus = read_names(args.names_file)
+        source = args.names_file
+    else:
+        rng = random.Random(args.seed)
+        corpus = build_names(args.names, build_titles(args.titles, rng), rng)
+        source = "synthetic"
+    if not corpus:
+        sys.exit("No rom names in " + source)
+    names = [name for name, _ in corpus]
+
+    start = time.perf_counter()
+    parsed = [normalize.parse_rom_name(name) for name in names]
+    elapsed = time.perf_counter() - start
+
+    groups = {}
+    for (name, group), rom_name in zip(corpus, parsed):
+        groups.setdefault(group, {}).setdefault(rom_name.key, name)
+    split = {group: keys for group, keys in groups.items() if len(keys) > 1}
+
+    raw_keys = len(set(names))
+    title_keys = len(set(name.key for name in parsed))
+    print("names: %d from %s, games: %d" % (len(names), source, len(groups)))
+    print("parse:            %.3f s (%.0f names/s)" % (elapsed, len(names) / elapsed))
+    print("raw stem keys:    %d searches, %.1f%% cache hits" % (raw_keys, 100 * (1 - raw_keys / len(names))))
+    print("title keys:       %d searches, %.1f%% cache hits" % (title_keys, 100 * (1 - title_keys / len(names))))
+    print("best possible:    %d searches, %.1f%% cache hits" % (len(groups), 100 * (1 - len(groups) / len(names))))
+    print("split games:      %d games parse to %d extra keys" % (len(split), sum(len(keys) - 1 for keys in split.values())))
+    for keys in sorted(split.values(), key=len, reverse=True)[:args.show]:
+        print("  " + " | ".join("%s -> %r" % (name, key) for key, name in sorted(keys.items())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+""" Measures process_snapshot against the per-pid process_iter it replaces on Linux, and snapshot diffing.
+
+Usage: python benchmarks/bench_proc_tools.py [--processes N [N ...]] [--rounds N]
+
+Needs psutil. The process tables are synthetic: a procfs tree with N processes is built in a temporary
+folder and psutil.PROCFS_PATH is pointed at it, so both versions read the same files. The live system
+is measured as well.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import psutil  # noqa: E402
+
+from galaxy import proc_tools  # noqa: E402
+
+BINARIES = (sys.executable, "/bin/sh", "/usr/bin/env")
+
+
+def per_pid_iter():
+    # process_iter before process_snapshot: a psutil.Process and as_dict for every pid
+    for pid in proc_tools.pids():
+        yield proc_tools.get_process_info(pid)
+
+
+def build_procfs(root, count):
+    with open(os.path.join(root, "stat"), "w") as stat:
+        stat.write("cpu  1 1 1 1 1 1 1 1 1 1\nbtime 1700000000\n")
+    for pid in range(1, count + 1):
+        folder = os.path.join(root, str(pid))
+        os.mkdir(folder)
+        with open(os.path.join(folder, "stat"), "w") as stat:
+            stat.write("%d (proc%d) S 1 %d %d 0 -1 4194560 %s\n" % (pid, pid, pid, pid, " ".join(["0"] * 44)))
+        os.symlink(BINARIES[pid % len(BINARIES)], os.path.join(folder, "exe"))
+
+
+def best_of(rounds, function):
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def measure(label, rounds):
+    old, infos = best_of(rounds, lambda: list(per_pid_iter()))
+    new, snapshot = best_of(rounds, proc_tools.process_snapshot)
+    previous = proc_tools.ProcessSnapshot(snapshot.pids[1:], snapshot.binary_paths[1:])
+    diff, _ = best_of(rounds, lambda: proc_tools.ProcessSnapshot(snapshot.pids, snapshot.binary_paths).diff(previous))
+    print("%s: %d processes" % (label, len(infos)))
+    print("  process_iter per pid:  %8.2f ms" % (old * 1000))
+    print("  process_snapshot:      %8.2f ms (%.1fx)" % (new * 1000, old / new))
+    print("  diff of two snapshots: %8.2f ms" % (diff * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    measure("live system", args.rounds)
+    procfs_path = psutil.PROCFS_PATH
+    for count in args.processes:
+        root = tempfile.mkdtemp()
+        try:
+            build_procfs(root, count)
+            psutil.PROCFS_PATH = root
+            measure("synthetic procfs", args.rounds)
+        finally:
+            psutil.PROCFS_PATH = procfs_path
+            shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+""" Compares the os.walk based rom scan with DirectoryScanner on a synthetic deep tree.
+
+Usage: python benchmarks/bench_scanner.py [--dirs N] [--files N] [--depth N] [--latency MS] [--workers N]
+
+--latency adds a delay to every directory listing and stat to emulate an SMB/NFS mount.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+import scanner  # noqa: E402
+
+
+def build_tree(root, dirs, files, depth):
+    for d in range(dirs):
+        path = os.path.join(root, *("d%d_%d" % (d, level) for level in range(1 + d % depth)))
+        os.makedirs(path, exist_ok=True)
+        for f in range(files):
+            with open(os.path.join(path, "Game %d-%d (U) [!].nes" % (d, f)), "wb") as rom:
+                rom.write(b"NES\x1a")
+
+
+def walk_scan(root):
+    """ The scan as NESClient._get_rom_names did it before the library index """
+    roms = {}
+    for path, _, files in os.walk(root):
+        for file in files:
+            if file.lower().endswith((".nes", ".fds", ".nsf", ".nsfe", ".unf")):
+                name = os.path.splitext(os.path.basename(file))[0]
+                roms[name] = os.path.join(path, file)
+    return roms
+
+
+def add_latency(seconds):
+    real_scandir, real_stat = os.scandir, os.stat
+
+    def slow_scandir(*args, **kwargs):
+        time.sleep(seconds)
+        return real_scandir(*args, **kwargs)
+
+    def slow_stat(*args, **kwargs):
+        time.sleep(seconds)
+        return real_stat(*args, **kwargs)
+
+    os.scandir, os.stat = slow_scandir, slow_stat
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dirs", type=int, default=500)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--depth", type=int, default=6)
+    parser.add_argument("--latency", type=float, default=2.0)
+    parser.add_argument("--workers", type=int, default=scanner.DEFAULT_WORKERS)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        build_tree(root, args.dirs, args.files, args.depth)
+        if args.latency:
+            add_latency(args.latency / 1000)
+
+        walk_time, walk_roms = timed(lambda: walk_scan(root))
+        dir_scanner = scanner.DirectoryScanner(args.workers)
+        scan_time, scan_roms = timed(lambda: list(dir_scanner.iter_roms(root)))
+        assert len(walk_roms) == len(scan_roms)
+
+        print("roms: %d, latency: %.1f ms, workers: %d" % (len(scan_roms), args.latency, args.workers))
+        print("os.walk:          %.3f s" % walk_time)
+        print("DirectoryScanner: %.3f s (%.1fx)" % (scan_time, walk_time / scan_time))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,99 +1,544 @@
+import asyncio
 import json
 import logging
 import os
+import threading
 import time
-import urllib.parse
-import urllib.request
 
 import config
+from catalog import PlatformCatalog
+from datfile import DatIndex, dat_game_id
 from definitions import NESGame
-from galaxy.api.types import LocalGame, LocalGameState
+from galaxy.api.errors import (BackendError, BackendNotAvailable, BackendTimeout, NetworkError, TooManyRequests,
+                               UnknownBackendResponse)
+from galaxy.api.jsonrpc import ApplicationError, UnknownError
+from giantbomb import GiantBombClient
+from hashing import BULK_HASH_THRESHOLD, BulkHasher, HashCache
+from headers import HeaderIndex
+from library import LibraryChanges, LibraryIndex, rom_name
+from metadata_cache import CacheEntry, MetadataCache
+from metrics import metrics
+from normalize import parse_rom_name
+from ratelimit import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL
 
-QUERY_URL = "https://www.giantbomb.com/api/search/?api_key={}&field_list=id,name&format=json&limit=1&query={}&resources=game"
+PIPELINE_QUEUE_SIZE = 64
+LOOKUP_WORKERS = 16
+# Seconds before each new attempt of the lookups that failed during an import
+LOOKUP_RETRY_DELAYS = (30, 120)
+# Failures worth trying again soon, anything else waits for the next import
+RETRYABLE_ERRORS = (BackendError, BackendNotAvailable, BackendTimeout, NetworkError, TooManyRequests,
+    UnknownBackendResponse, UnknownError)
 
 class NESClient:
     def __init__(self, plugin):
         self.games = []
         self.plugin = plugin
-        self.roms = {}
-        self.start_time = 0
-        self.end_time = 0
+        self.library = LibraryIndex(os.path.expandvars(config.LIBRARY_INDEX_LOC))
+        self.hashes = HashCache(os.path.expandvars(config.HASH_CACHE_LOC))
+        self.bulk_hasher = BulkHasher()
+        self.headers = HeaderIndex(os.path.expandvars(config.HEADER_INDEX_LOC))
+        self.dat = DatIndex(os.path.expandvars(config.DAT_SNAPSHOT_LOC))
+        self.giant_bomb = GiantBombClient()
+        self.metadata = MetadataCache(os.path.expandvars(config.METADATA_CACHE_LOC))
+        self.catalog = PlatformCatalog(os.path.expandvars(config.CATALOG_LOC))
+        self.roms = {rom_name(path): path for path in self.library.roms}
+        self.pending = {}  # rom path -> number of failed lookups
+        self.replaced = {}  # game id -> NESGame of modified roms until an import resolves them again
+        # The watcher thread and the import both rescan, the library, rom names and header index change together
+        self._rescan_lock = threading.RLock()
+        self.import_start = 0
+        self.first_game_pending = False
+        self._apply_settings(None, self.plugin.config.snapshot())
+        self.plugin.config.subscribe(self._apply_settings)
 
 
-    def _get_games_giant_bomb(self) -> list:
-        ''' Returns a list of NESGame objects with id, name, and path
+    def _apply_settings(self, old, new) -> None:
+        ''' Returns None
 
-        Used if the user chooses to pull from Giant Bomb database
-        The first result is used and only call for id and name, in json format, limited to 1 result
+        Passes the scanner and Giant Bomb settings on, called again whenever config.ini changes
         '''
-        self._get_rom_names()
+        self.library.scanner.workers = new.scan_workers
+        self.giant_bomb.set_max_requests(new.max_requests)
+        self.giant_bomb.request_timeout = new.request_timeout
+        self.giant_bomb.rate_limiter.configure(new.requests_per_hour / 3600, new.request_burst)
+        self.catalog.max_age = new.catalog_max_age_days * 24 * 60 * 60
 
-        for rom in self.roms:
-            if rom in self.plugin.persistent_cache:
-                logging.debug("DEV: Value was in cache - %s", rom)
-                cached_results = json.loads(self.plugin.persistent_cache.get(rom))
-                id = cached_results.get("id")
-                name = cached_results.get("name")
-            else:
-                self.plugin.config.cfg.read(os.path.expandvars(config.CONFIG_LOC))
-                url = QUERY_URL.format(self.plugin.config.cfg.get("Method", "api_key"), urllib.parse.quote(rom))
-                with urllib.request.urlopen(url) as response:
-                    search_results = json.loads(response.read())
-                    logging.debug("DEV: Search results from url request - %s", search_results)
-                id = search_results["results"][0]["id"]
-                name = search_results["results"][0]["name"]
-                self.plugin.persistent_cache[rom] = { "id" : id, "name" : name }
-            
-            self.games.append(
-                NESGame(
-                    str(id),
-                    str(name),
-                    str(self.roms.get(rom))
-                )
-            )
-
-        self.plugin.push_cache()
+    async def _get_games_giant_bomb(self) -> list:
+        ''' Returns a list of NESGame objects with id, name, and path that are known without scanning or looking up
+
+        Used if the user chooses to pull from Giant Bomb database.
+        Roms of the library index whose hash is cached are resolved from the cache and the DAT files,
+        stale cache entries are used right away and refreshed in the background.
+        Everything else is left to _stream_games.
+        '''
+        self.import_start = time.monotonic()
+        self.first_game_pending = True
+        self.bulk_hasher.reset()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.dat.load, self.plugin.config.snapshot().dat_path)
+        games = []
+        for rom, path in list(self.roms.items()):
+            if not self.headers.is_valid(path) or not self.hashes.is_cached(path, *self._hash_args(path)):
+                continue
+            game, _ = self._resolve_local_game(rom, path)
+            if game is not None:
+                games.append(game)
+        self.games = games
+        if games:
+            self._game_ready()
         return self.games
 
 
-    def _get_rom_names(self) -> None:
-        ''' Returns none
-        
-        Appends the rom names and paths to their corresponding lists
-        '''        
-        self.plugin.config.cfg.read(os.path.expandvars(config.CONFIG_LOC))        
-        for root, dirs, files in os.walk(self.plugin.config.cfg.get("Paths", "roms_path")):
-            for file in files:
-               if file.lower().endswith((".nes", ".fds", ".nsf", ".nsfe", ".unf")):
-                    name = os.path.splitext(os.path.basename(file))[0] # Split name of file from it's path/extension
-                    path = os.path.join(root, file)
-                    self.roms[name] = path
-
-
-    def _get_state_changes(self, old_list, new_list) -> list:
-        old_dict = {x.game_id: x.local_game_state for x in old_list}
-        new_dict = {x.game_id: x.local_game_state for x in new_list}
-        result = []
-        # removed games
-        result.extend(LocalGame(id, LocalGameState.None_) for id in old_dict.keys() - new_dict.keys())
-        # added games
-        result.extend(local_game for local_game in new_list if local_game.game_id in new_dict.keys() - old_dict.keys())
-        # state changed
-        result.extend(
-            LocalGame(id, new_dict[id]) for id in new_dict.keys() & old_dict.keys() if new_dict[id] != old_dict[id])
-        return result
-
-    def _set_session_start(self) -> None:
-        ''' Sets the session start to the current time'''
-        self.start_time = time.time()
-
-
-    def _set_session_end(self) -> None:
-        ''' Sets the session end to the current time'''
-        self.end_time = time.time()
-
-
-    def _get_session_duration(self) -> int:
-        ''' Returns the duration of the game session in minutes as an int'''
-        return int(round((self.end_time - self.start_time) / 60))
-        
\ No newline at end of file
+    async def _stream_games(self, on_added, on_removed, on_scanned=None) -> None:
+        ''' Returns None
+
+        Imports the roms folder as a pipeline of scan, hash, lookup and notify stages connected by bounded queues.
+        The scan has to finish to know which roms are gone, after that every rom is hashed, looked up and handed to
+        on_added as soon as it is resolved. Games of roms that were removed are handed to on_removed, games of
+        modified roms only once the import is done and no rom provides them anymore.
+        on_scanned is called once the scan stage is done, while roms are still being hashed and looked up.
+        '''
+        loop = asyncio.get_running_loop()
+        changes = await loop.run_in_executor(None, self._get_rom_names)
+        for game in self._apply_removals(changes):
+            on_removed(game)
+        if on_scanned is not None:
+            on_scanned()
+
+        resolved_paths = {game.path for game in self.games}
+        cached = []
+        unhashed = []
+        for rom, path in list(self.roms.items()):
+            if path in resolved_paths or not self.headers.is_valid(path):
+                continue
+            size, mtime, crc32 = self._hash_args(path)
+            if self.hashes.is_cached(path, size, mtime, crc32):
+                cached.append((rom, path))
+            else:
+                unhashed.append((path, size, mtime))
+
+        lookups = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        resolved = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+        stages = [
+            asyncio.ensure_future(self._hash_stage(cached, unhashed, lookups, resolved)),
+            asyncio.ensure_future(self._lookup_stage(lookups, resolved)),
+            asyncio.ensure_future(self._notify_stage(resolved, on_added)),
+        ]
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            for stage in stages:
+                stage.cancel()
+            await loop.run_in_executor(None, self.hashes.save)
+            self.metadata.commit()
+
+        known_ids = {game.id for game in self.games}
+        replaced, self.replaced = self.replaced, {}
+        for game in replaced.values():
+            if game.id not in known_ids:
+                on_removed(game)
+
+        metrics.set("import.total_time", round(time.monotonic() - self.import_start, 3))
+        logging.debug("DEV: Import finished with %d games", len(self.games))
+
+
+    async def _hash_stage(self, cached, unhashed, lookups, resolved) -> None:
+        ''' Returns None
+
+        Resolves roms from the cache and the DAT files as their hashes become available,
+        roms that have to be looked up go to the lookup stage
+        '''
+        async def resolve(rom, path):
+            game, refresh = self._resolve_local_game(rom, path)
+            if game is not None:
+                await resolved.put(game)
+            elif refresh:
+                await lookups.put((rom, path))
+
+        for rom, path in cached:
+            await resolve(rom, path)
+        async for rom, path in self._hash_roms(unhashed):
+            await resolve(rom, path)
+        for _ in range(LOOKUP_WORKERS):
+            await lookups.put(None)
+        await asyncio.get_running_loop().run_in_executor(None, self.hashes.save)
+
+
+    async def _lookup_stage(self, lookups, resolved) -> None:
+        ''' Returns None
+
+        Looks up roms with LOOKUP_WORKERS lookups in flight, the rate limiter decides when they are sent.
+        Lookups that failed with a retryable error are queued again after each of the LOOKUP_RETRY_DELAYS,
+        roms that still fail stay pending for the next import.
+        '''
+        failed = []
+
+        async def worker(queue):
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                rom, path = item
+                if self.roms.get(rom) != path:
+                    continue
+                game, retry = await self._lookup_rom(rom, path)
+                if game is not None:
+                    await resolved.put(game)
+                elif retry:
+                    failed.append(item)
+
+        await asyncio.gather(*(worker(lookups) for _ in range(LOOKUP_WORKERS)))
+        for delay in LOOKUP_RETRY_DELAYS:
+            if not failed:
+                break
+            logging.debug("DEV: Retrying %d failed lookups in %d seconds", len(failed), delay)
+            await asyncio.sleep(delay)
+            retries = asyncio.Queue()
+            for item in failed + [None] * LOOKUP_WORKERS:
+                retries.put_nowait(item)
+            failed.clear()
+            await asyncio.gather(*(worker(retries) for _ in range(LOOKUP_WORKERS)))
+        await resolved.put(None)
+
+
+    async def _lookup_rom(self, rom, path, priority=PRIORITY_NORMAL) -> tuple:
+        ''' Returns a tuple of the NESGame from _get_remote_game and whether a failed lookup should be retried
+
+        A failed lookup only affects its own rom, whatever it raised. Nothing is cached for it,
+        so it stays pending until a lookup succeeds.
+        Results are committed right away so an interrupted import resumes after the lookups that succeeded.
+        '''
+        try:
+            game = await self._get_remote_game(rom, path, priority)
+        except asyncio.CancelledError:
+            # An Exception before Python 3.8, an import that is stopped must not count it as a failed lookup
+            raise
+        except ApplicationError as error:
+            self._lookup_failed(path)
+            logging.warning("DEV: Lookup failed %d times for rom - %s: %r", self.pending[path], rom, error)
+            return None, isinstance(error, RETRYABLE_ERRORS)
+        except Exception:
+            self._lookup_failed(path)
+            logging.exception("DEV: Lookup failed %d times for rom - %s", self.pending[path], rom)
+            return None, False
+
+        self.metadata.commit()
+        if self.pending.pop(path, None) is not None:
+            metrics.set("import.pending", len(self.pending))
+        return game, False
+
+
+    def _lookup_failed(self, path) -> None:
+        self.pending[path] = self.pending.get(path, 0) + 1
+        metrics.increment("import.lookup_failures")
+        metrics.set("import.pending", len(self.pending))
+
+
+    async def _notify_stage(self, resolved, on_added) -> None:
+        ''' Returns None
+
+        Adds resolved games to the games list and hands the ones with a new id to on_added,
+        games of roms that were removed or replaced in the meantime are dropped.
+        Galaxy still has the games of modified roms, they are not added again.
+        '''
+        announced = {game.id for game in self.games}
+        announced.update(self.replaced)
+        while True:
+            game = await resolved.get()
+            if game is None:
+                return
+            if self.roms.get(rom_name(game.path)) != game.path:
+                continue
+            is_new = game.id not in announced
+            announced.add(game.id)
+            self.games.append(game)
+            if is_new:
+                self._game_ready()
+                metrics.increment("import.games_streamed")
+                on_added(game)
+
+
+    def _game_ready(self) -> None:
+        if self.first_game_pending:
+            self.first_game_pending = False
+            metrics.set("import.time_to_first_game", round(time.monotonic() - self.import_start, 3))
+
+
+    def _resolve_local_game(self, rom, path) -> tuple:
+        ''' Returns the tuple of _get_local_game, starting the revalidation of a stale cached game'''
+        game, refresh = self._get_local_game(rom, path)
+        if game is not None and refresh:
+            self.plugin.create_task(self._revalidate_game(rom, path, game), "Revalidate game metadata")
+        return game, refresh
+
+
+    def _get_local_game(self, rom, path) -> tuple:
+        ''' Returns a tuple of a NESGame object for a rom from the cache or the DAT files and whether to look it up
+
+        The NESGame is None if the rom is unknown or a previous lookup found nothing. Look it up if the flag is set,
+        when it is set together with a NESGame the cached result is stale and can be revalidated in the background.
+        Results are cached by the content hash of the rom so renamed, moved and duplicate roms are not looked up again.
+        Roms known to the DAT files are named after their DAT entry and share the id of its title with the other dumps.
+        The hash of the rom must already be cached.
+        '''
+        rom_hash = self.hashes.get(path, *self._hash_args(path))
+        key = rom_hash.key
+        entry = self.metadata.get(key)
+        if entry is None:
+            entry = self._migrate_cache_entry(key, rom)
+
+        if entry is not None and entry.value is not None:
+            logging.debug("DEV: Value was in cache - %s", rom)
+            return NESGame(str(entry.value["id"]), str(entry.value["name"]), str(path)), entry.stale
+
+        title = self.dat.lookup(rom_hash)
+        if title is not None:
+            return NESGame(dat_game_id(title), title, str(path)), False
+        return None, entry is None or entry.stale
+
+
+    def _migrate_cache_entry(self, key, rom) -> CacheEntry:
+        ''' Returns the CacheEntry moved over from the Galaxy persistent cache, None if there is none
+
+        Older versions cached results there by content hash or rom name, as dicts or JSON strings
+        '''
+        value = self.plugin.persistent_cache.get(key, self.plugin.persistent_cache.get(rom))
+        if value is None:
+            return None
+        try:
+            value = json.loads(value) if isinstance(value, str) else value
+            value = { "id": value["id"], "name": value["name"] }
+        except (ValueError, KeyError, TypeError):
+            logging.debug("DEV: Ignoring unreadable cache entry - %s", rom)
+            return None
+        self.metadata.put(key, value)
+        return CacheEntry(value, False)
+
+
+    async def _get_remote_game(self, rom, path, priority=PRIORITY_NORMAL) -> NESGame:
+        ''' Returns a NESGame object for a rom from Giant Bomb, None if nothing was found
+
+        The lookup uses the title without GoodNES/No-Intro tags and its result is also cached under the canonical
+        title key, so other releases and dumps of the same game need no lookup of their own.
+        Lookups that found nothing are cached too so they are not repeated on every import.
+        A stale title entry is used if Giant Bomb cannot be reached, as while its circuit breaker is open.
+        '''
+        key = self.hashes.get(path, *self._hash_args(path)).key
+        name = parse_rom_name(rom)
+        title_key = "title:" + name.key
+        entry = self.metadata.get(title_key)
+        if entry is not None and not entry.stale:
+            result = entry.value
+            self.metadata.put(key, result)
+        else:
+            try:
+                result = await self._find_game(name.title, priority)
+            except ApplicationError as error:
+                if entry is None:
+                    raise
+                logging.debug("DEV: Using stale metadata of rom - %s: %r", rom, error)
+                result = entry.value
+            else:
+                self.metadata.put(title_key, result)
+                self.metadata.put(key, result)
+        if result is None:
+            logging.debug("DEV: No search results for rom - %s", rom)
+            return None
+
+        return NESGame(
+            str(result["id"]),
+            str(result["name"]),
+            str(path)
+        )
+
+
+    async def _find_game(self, title, priority) -> dict:
+        ''' Returns the id and name of the Giant Bomb game for a title, None if nothing was found
+
+        With use_catalog the title is matched against the local copy of the NES game list,
+        otherwise the first result of a search is used and only call for id and name, limited to 1 result.
+        '''
+        settings = self.plugin.config.snapshot()
+        if not settings.use_catalog:
+            return await self.giant_bomb.search(settings.api_key, title, priority)
+
+        loop = asyncio.get_running_loop()
+        if not self.catalog.loaded:
+            await loop.run_in_executor(None, self.catalog.load)
+        if self.catalog.needs_refresh():
+            try:
+                games = await self.giant_bomb.platform_games(settings.api_key, priority)
+                if self.catalog.needs_refresh():
+                    await loop.run_in_executor(None, self.catalog.replace, games)
+            except (ApplicationError, KeyError, ValueError):
+                # Keep matching against the outdated list while Giant Bomb cannot be reached
+                self.catalog.attempted_at = self.catalog.clock()
+                logging.exception("DEV: Failed to download the catalog, using the one from %s", self.catalog.fetched_at)
+        if not self.catalog.games:
+            # Nothing can be matched yet, the rom is retried instead of being cached as not found
+            raise BackendNotAvailable({ "catalog": "empty" })
+        return self.catalog.match(title)
+
+
+    async def _revalidate_game(self, rom, path, game) -> None:
+        ''' Returns None
+
+        Refreshes a stale cache entry, a renamed game is updated in Galaxy right away
+        while a game that now resolves to another id is picked up on the next import
+        '''
+        try:
+            new_game = await self._get_remote_game(rom, path, PRIORITY_LOW)
+        except ApplicationError as error:
+            logging.debug("DEV: Keeping stale metadata of rom - %s: %r", rom, error)
+            return
+        self.metadata.commit()
+        if new_game is not None and new_game.id == game.id and new_game.name != game.name:
+            game.name = new_game.name
+            self.plugin.update_game(self.plugin._to_galaxy_game(game))
+
+
+    async def _hash_roms(self, unhashed):
+        ''' Returns an async iterator of (rom name, path) of the (path, size, mtime) in unhashed once their hash is cached
+
+        If many roms were never hashed, as on the first import of a library,
+        they are hashed in bulk and yielded as they finish, so lookups start before hashing is done.
+        '''
+        if len(unhashed) < BULK_HASH_THRESHOLD:
+            loop = asyncio.get_running_loop()
+            for path, size, mtime in unhashed:
+                try:
+                    await loop.run_in_executor(None, self.hashes.get, path, size, mtime)
+                except OSError:
+                    logging.exception("DEV: Failed to hash rom - %s", path)
+                    continue
+                yield rom_name(path), path
+            return
+
+        logging.debug("DEV: Hashing %d roms in bulk", len(unhashed))
+        async for path, size, mtime, rom_hash in self.bulk_hasher.hash_all(unhashed, self._log_hash_progress):
+            self.hashes.put(path, size, mtime, rom_hash)
+            yield rom_name(path), path
+
+
+    @staticmethod
+    def _log_hash_progress(done, total) -> None:
+        if done == total or done % 100 == 0:
+            logging.debug("DEV: Hashed %d of %d roms", done, total)
+
+
+    def _hash_args(self, path) -> tuple:
+        ''' Returns (size, mtime, crc32) of a rom for the hash cache
+
+        The crc32 from an archive directory includes the header, so headered roms in archives
+        get None and are hashed without it like plain files
+        '''
+        size, mtime, crc32 = self.library.roms[path]
+        if crc32 is not None and self.headers.has_header(path):
+            crc32 = None
+        return size, mtime, crc32
+
+
+    def _get_rom_names(self) -> LibraryChanges:
+        ''' Returns the LibraryChanges of the roms folder
+
+        Rescans the roms folder through the library index and applies the changes to the rom names and paths,
+        then reads the headers of roms that are not in the header index yet
+        '''
+        with self._rescan_lock:
+            changes = self._rescan()
+            self.dat.load(self.plugin.config.snapshot().dat_path)
+            for path, (size, mtime, _) in list(self.library.roms.items()):
+                self.headers.update(path, size, mtime)
+            self.headers.save()
+        return changes
+
+
+    def _rescan(self, full=False, dirty=()) -> LibraryChanges:
+        ''' Returns the LibraryChanges of the roms folder
+
+        Keeps the rom names and paths in sync with the library index, may be called from any thread
+        '''
+        with self._rescan_lock:
+            changes = self.library.rescan(self.plugin.config.snapshot().roms_path, full, dirty)
+            if not changes:
+                return changes
+
+            for path in changes.removed:
+                name = rom_name(path)
+                if self.roms.get(name) == path:
+                    del self.roms[name]
+            for path in changes.added + changes.modified:
+                self.roms[rom_name(path)] = path
+            self.hashes.prune(changes.removed)
+            self.headers.remove(changes.removed)
+            for path in changes.added + changes.modified:
+                self.headers.update(path, *self.library.roms[path][:2])
+            self.library.save()
+            self.headers.save()
+        return changes
+
+
+    async def _get_changed_games(self, changes) -> tuple:
+        ''' Returns a tuple of the added and removed NESGame objects
+
+        Resolves the roms that were added or modified and updates the games list accordingly
+        '''
+        loop = asyncio.get_running_loop()
+        new_games = []
+        lookups = []
+        for path in changes.added + changes.modified:
+            name = rom_name(path)
+            if self.roms.get(name) != path or not self.headers.is_valid(path):
+                continue
+            try:
+                await loop.run_in_executor(None, self.hashes.get, path, *self._hash_args(path))
+            except OSError:
+                logging.exception("DEV: Failed to hash rom - %s", path)
+                continue
+            game, refresh = self._get_local_game(name, path)
+            if game is not None:
+                new_games.append(game)
+            elif refresh:
+                # Roms added while Galaxy is open are what the user is about to play
+                lookups.append(asyncio.ensure_future(self._lookup_rom(name, path, PRIORITY_HIGH)))
+        new_games.extend(game for game, _ in await asyncio.gather(*lookups) if game is not None)
+
+        # Taken before the modified roms are dropped, Galaxy already has their games
+        announced_ids = {game.id for game in self.games}.union(self.replaced)
+        removed = self._remove_games(changes.removed + changes.modified)
+        known_ids = {game.id for game in self.games}
+        added = []
+        for game in new_games:
+            if game.id not in announced_ids:
+                added.append(game)
+                announced_ids.add(game.id)
+            known_ids.add(game.id)
+        # A removed rom whose game is still provided by an added one stays in Galaxy
+        removed = [game for game in removed if game.id not in known_ids]
+
+        self.games.extend(new_games)
+        await loop.run_in_executor(None, self.hashes.save)
+        self.metadata.commit()
+        return added, removed
+
+
+    def _apply_removals(self, changes) -> list:
+        ''' Returns a list of the NESGame objects of removed roms that no rom provides anymore
+
+        Games of modified roms are kept in replaced until an import resolves them again
+        '''
+        for game in self._remove_games(changes.modified):
+            self.replaced[game.id] = game
+        return [game for game in self._remove_games(changes.removed) if game.id not in self.replaced]
+
+
+    def _remove_games(self, paths) -> list:
+        ''' Returns a list of the NESGame objects no rom provides anymore
+
+        Drops the games of the given rom paths from the games list
+        '''
+        stale_paths = set(paths)
+        old_games = [game for game in self.games if game.path in stale_paths]
+        self.games = [game for game in self.games if game.path not in stale_paths]
+        known_ids = {game.id for game in self.games}
+        return list({game.id: game for game in old_games if game.id not in known_ids}.values())
@@ -0,0 +1,119 @@
+import logging
+import os
+import shutil
+import threading
+import zipfile
+import zlib
+from contextlib import contextmanager
+
+ARCHIVE_EXTENSIONS = (".zip",)
+# Not a valid file name character on Windows, so it never appears in a real path there
+ARCHIVE_SEPARATOR = "|"
+
+
+def member_path(archive, member) -> str:
+    ''' Returns the library path of a rom stored in an archive'''
+    return archive + ARCHIVE_SEPARATOR + member
+
+
+def split_member(path) -> tuple:
+    ''' Returns (archive path, member name) of a library path, member name is None for plain files'''
+    archive, separator, member = path.rpartition(ARCHIVE_SEPARATOR)
+    if not separator:
+        return path, None
+    return archive, member
+
+
+def list_archive(path, extensions) -> list:
+    ''' Returns (member name, uncompressed size, crc32) of every rom in an archive
+
+    Only the central directory is read, nothing is decompressed
+    '''
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return [(info.filename, info.file_size, "%08x" % info.CRC) for info in archive.infolist()
+                if not info.is_dir() and info.filename.lower().endswith(extensions)]
+    except (OSError, zipfile.BadZipFile):
+        logging.exception("DEV: Failed to read archive - %s", path)
+        return []
+
+
+@contextmanager
+def open_rom(path):
+    ''' Returns a context manager yielding (file object, size) of a rom
+
+    Roms stored in an archive are decompressed as they are read, so reading a header only inflates its first block
+    '''
+    archive_path, member = split_member(path)
+    if member is None:
+        with open(path, "rb") as rom:
+            yield rom, os.fstat(rom.fileno()).st_size
+        return
+
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            info = archive.getinfo(member)
+            with archive.open(info) as rom:
+                yield rom, info.file_size
+    except (zipfile.BadZipFile, KeyError, zlib.error, EOFError) as error:
+        # A damaged member only fails once it is inflated, it is reported like any other unreadable rom
+        raise OSError("Failed to open {}: {}".format(path, error)) from error
+
+
+class ExtractCache:
+    ''' Size-bounded folder of roms extracted from archives for launching
+
+    The least recently launched roms are deleted once the folder grows past max_bytes.
+    '''
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+
+    def extract(self, path, crc32) -> str:
+        ''' Returns the path of a launchable rom
+
+        Plain files are returned as they are, archive members are extracted unless they already are
+        '''
+        archive_path, member = split_member(path)
+        if member is None:
+            return path
+
+        target = os.path.join(self.path, "{}_{}".format(crc32, os.path.basename(member)))
+        with self._lock:
+            if os.path.isfile(target):
+                os.utime(target)
+                return target
+
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            tmp_target = target + ".tmp"
+            with open_rom(path) as (rom, _), open(tmp_target, "wb") as extracted:
+                shutil.copyfileobj(rom, extracted)
+            os.replace(tmp_target, target)
+            self._evict(keep=target)
+        logging.debug("DEV: Extracted rom - %s", target)
+        return target
+
+
+    def _evict(self, keep) -> None:
+        entries = []
+        with os.scandir(self.path) as files:
+            for entry in files:
+                if entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+                logging.debug("DEV: Evicted extracted rom - %s", path)
+            except OSError:
+                logging.exception("DEV: Failed to evict extracted rom - %s", path)
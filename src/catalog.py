@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+from normalize import title_key
+
+CATALOG_VERSION = 1
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+# A failed download is not tried again for every rom of an import
+RETRY_INTERVAL = 60 * 60
+MIN_SIMILARITY = 0.6
+# Candidates scoring this close to the best one are ranked by edit distance
+TIE_MARGIN = 0.05
+
+
+def trigrams(key) -> set:
+    ''' Returns the set of character trigrams of a title key, padded so word starts and ends count'''
+    padded = "  " + key + " "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b) -> int:
+    ''' Returns the Levenshtein distance between two strings'''
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+class TitleMatcher:
+    ''' Trigram index resolving rom titles to catalog games without asking Giant Bomb
+
+    Every game is indexed under its name and aliases. Titles are compared by the Dice coefficient
+    of their trigrams, near ties are broken by the edit distance of the title keys.
+    '''
+    def __init__(self, games=()):
+        self.games = []
+        self.keys = []  # (title key, trigram count, game number)
+        self.exact = {}  # title key -> game number
+        self.postings = {}  # trigram -> numbers in keys
+        for game in games:
+            self.add(game)
+
+
+    def add(self, game) -> None:
+        number = len(self.games)
+        self.games.append(game)
+        names = [game["name"]] + list(game.get("aliases") or ())
+        for name in names:
+            key = title_key(name)
+            if not key or key in self.exact:
+                continue
+            self.exact[key] = number
+            grams = trigrams(key)
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(len(self.keys))
+            self.keys.append((key, len(grams), number))
+
+
+    def match(self, title) -> Optional[dict]:
+        ''' Returns the catalog game best matching a title, None if none is similar enough'''
+        key = title_key(title)
+        if key in self.exact:
+            return self.games[self.exact[key]]
+        if not key:
+            return None
+
+        grams = trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+        if not shared:
+            return None
+
+        scores = [(2 * count / (len(grams) + self.keys[number][1]), number) for number, count in shared.items()]
+        best = max(score for score, _ in scores)
+        if best < MIN_SIMILARITY:
+            return None
+        candidates = [number for score, number in scores if score >= best - TIE_MARGIN]
+        number = min(candidates, key=lambda number: edit_distance(key, self.keys[number][0]))
+        return self.games[self.keys[number][2]]
+
+
+class PlatformCatalog:
+    ''' Local copy of the Giant Bomb game list of the NES platform
+
+    Stored as JSON with the time it was downloaded. An outdated copy is still used
+    when a new one cannot be downloaded.
+    '''
+    def __init__(self, path, max_age=DEFAULT_MAX_AGE, clock=time.time):
+        self.path = path
+        self.max_age = max_age
+        self.clock = clock
+        self.games = []
+        self.fetched_at = 0
+        self.attempted_at = 0
+        self.matcher = TitleMatcher()
+        self.loaded = False
+        self._lock = threading.Lock()
+
+
+    def load(self) -> None:
+        ''' Returns None
+
+        Reads the stored catalog, a missing or unreadable file leaves the catalog empty
+        '''
+        with self._lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            try:
+                with open(self.path, encoding="utf-8") as catalog_file:
+                    data = json.load(catalog_file)
+                if data.get("version") != CATALOG_VERSION:
+                    return
+                self._set_games(data["games"], data["fetched_at"])
+            except FileNotFoundError:
+                pass
+            except (ValueError, KeyError, TypeError):
+                logging.exception("DEV: Catalog is unreadable and will be downloaded again")
+
+
+    def needs_refresh(self) -> bool:
+        ''' Returns True if the catalog is empty or outdated and no download was tried recently'''
+        now = self.clock()
+        if now - self.attempted_at < RETRY_INTERVAL:
+            return False
+        return not self.games or now - self.fetched_at > self.max_age
+
+
+    def replace(self, games) -> None:
+        ''' Returns None
+
+        Replaces the games of the catalog with a new download and stores it
+        '''
+        with self._lock:
+            self._set_games(games, self.clock())
+            self._save()
+        logging.debug("DEV: Catalog has %d games", len(self.games))
+
+
+    def match(self, title) -> Optional[dict]:
+        ''' Returns the id and name of the catalog game matching a title, None if there is none'''
+        game = self.matcher.match(title)
+        if game is None:
+            return None
+        return { "id": game["id"], "name": game["name"] }
+
+
+    def _set_games(self, games, fetched_at) -> None:
+        self.games = games
+        self.fetched_at = fetched_at
+        self.matcher = TitleMatcher(games)
+
+
+    def _save(self) -> None:
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as catalog_file:
+            json.dump({ "version": CATALOG_VERSION, "fetched_at": self.fetched_at, "games": self.games }, catalog_file)
+        os.replace(tmp_path, self.path)
@@ -1,21 +1,135 @@
 import configparser
+import logging
+import os
 import textwrap
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
 
 CONFIG_LOC = r"%LOCALAPPDATA%\GOG.com\Galaxy\Configuration\plugins\nes\config.ini"
+LIBRARY_INDEX_LOC = r"%LOCALAPPDATA%\GOG.com\Galaxy\Configuration\plugins\nes\library_index.json"
+HASH_CACHE_LOC = r"%LOCALAPPDATA%\GOG.com\Galaxy\Configuration\plugins\nes\hash_cache.json"
+HEADER_INDEX_LOC = r"%LOCALAPPDATA%\GOG.com\Galaxy\Configuration\plugins\nes\header_index.json"
+EXTRACT_CACHE_LOC = r"%LOCALAPPDATA%\GOG.com\Galaxy\Configuration\plugins\nes\extracted"
+DAT_SNAPSHOT_LOC = r"%LOCALAPPDATA%\GOG.com\Galaxy\Configuration\plugins\nes\dat_index.bin"
+METADATA_CACHE_LOC = r"%LOCALAPPDATA%\GOG.com\Galaxy\Configuration\plugins\nes\metadata.sqlite"
+CATALOG_LOC = r"%LOCALAPPDATA%\GOG.com\Galaxy\Configuration\plugins\nes\catalog.json"
+GAME_TIMES_LOC = r"%LOCALAPPDATA%\GOG.com\Galaxy\Configuration\plugins\nes\game_times.json"
+GAME_TIMES_JOURNAL_LOC = r"%LOCALAPPDATA%\GOG.com\Galaxy\Configuration\plugins\nes\game_times.journal"
+
+# Connections of the Giant Bomb session, more requests than this cannot be in flight
+MAX_REQUESTS_LIMIT = 20
+
+
+def _clamp(name, value, minimum, maximum=None):
+    ''' Returns value limited to [minimum, maximum], logging when a setting from config.ini had to be changed'''
+    # Written so NaN is clamped as well
+    if not value >= minimum:
+        logging.warning("DEV: %s is %s, using %s", name, value, minimum)
+        return minimum
+    if maximum is not None and value > maximum:
+        logging.warning("DEV: %s is %s, using %s", name, value, maximum)
+        return maximum
+    return value
+
+
+@dataclass(frozen=True)
+class Settings():
+    """ Settings object, an immutable snapshot of config.ini.
+
+    :param roms_path: folder of the roms
+    :param emu_path: path to Mesen.exe
+    :param dat_path: folder of No-Intro/TOSEC DAT files
+    :param scan_workers: number of folders listed at the same time
+    :param watch_interval: seconds between polls of the roms folder
+    :param api_key: Giant Bomb API key
+    :param max_requests: number of Giant Bomb requests in flight at the same time
+    :param requests_per_hour: pace of Giant Bomb requests
+    :param request_burst: number of Giant Bomb requests allowed in a burst
+    :param request_timeout: seconds a Giant Bomb request may take
+    :param use_catalog: True to match roms against the downloaded NES game list
+    :param catalog_max_age_days: days before the game list is downloaded again
+    :param emu_fullscreen: True to launch Mesen in fullscreen
+    :param extract_cache_mb: megabytes kept for roms extracted from zip files
+    :param launch_timeout: seconds Mesen has to keep running after it started for the launch to succeed
+    :param detect_external_launches: True to track play time of games started outside of Galaxy
+    :param discovery_interval: seconds between looks for Mesen started outside of Galaxy
+    """
+    roms_path: str
+    emu_path: Optional[str]
+    dat_path: str
+    scan_workers: int
+    watch_interval: float
+    api_key: Optional[str] = field(repr=False)
+    max_requests: int
+    requests_per_hour: float
+    request_burst: int
+    request_timeout: float
+    use_catalog: bool
+    catalog_max_age_days: float
+    emu_fullscreen: bool
+    extract_cache_mb: int
+    launch_timeout: float
+    detect_external_launches: bool
+    discovery_interval: float
+
+    @classmethod
+    def from_parser(cls, cfg):
+        return cls(
+            roms_path=cfg.get("Paths", "roms_path"),
+            emu_path=cfg.get("Paths", "emu_path"),
+            dat_path=cfg.get("Paths", "dat_path") or "",
+            scan_workers=_clamp("scan_workers", cfg.getint("Paths", "scan_workers"), 1),
+            watch_interval=_clamp("watch_interval", cfg.getfloat("Paths", "watch_interval"), 0.1),
+            api_key=cfg.get("Method", "api_key"),
+            max_requests=_clamp("max_requests", cfg.getint("Method", "max_requests"), 1, MAX_REQUESTS_LIMIT),
+            requests_per_hour=_clamp("requests_per_hour", cfg.getfloat("Method", "requests_per_hour"), 1.0),
+            request_burst=_clamp("request_burst", cfg.getint("Method", "request_burst"), 1),
+            request_timeout=_clamp("request_timeout", cfg.getfloat("Method", "request_timeout"), 1.0),
+            use_catalog=cfg.getboolean("Method", "use_catalog"),
+            catalog_max_age_days=_clamp("catalog_max_age_days", cfg.getfloat("Method", "catalog_max_age_days"), 0.0),
+            emu_fullscreen=cfg.getboolean("EmuSettings", "emu_fullscreen"),
+            extract_cache_mb=_clamp("extract_cache_mb", cfg.getint("EmuSettings", "extract_cache_mb"), 0),
+            launch_timeout=_clamp("launch_timeout", cfg.getfloat("EmuSettings", "launch_timeout"), 0.0),
+            detect_external_launches=cfg.getboolean("EmuSettings", "detect_external_launches"),
+            discovery_interval=_clamp("discovery_interval", cfg.getfloat("EmuSettings", "discovery_interval"), 1.0),
+        )
+
 
 class Config:
+    ''' Defaults of config.ini and the Settings read from it
+
+    cfg holds the defaults and comments config.ini is written from. snapshot() reads the file again only
+    when its mtime or size changed and tells the subscribers about every change.
+    '''
     def __init__(self):
         self.cfg = configparser.ConfigParser(allow_no_value=True)
         self.cfg.set("DEFAULT", "; Make sure to use / instead of \ in file paths.")
         self.cfg["DEFAULT"]["roms_path"] = "C:/Games/NES"
         self.cfg["DEFAULT"]["emu_path"] = "C:/Program Files (x86)/Mesen/Mesen.exe"
+        self.cfg["DEFAULT"]["dat_path"] = ""
         self.cfg["DEFAULT"]["api_key"] = None
-        self.cfg["DEFAULT"]["emu_fullscreen"] = False
+        self.cfg["DEFAULT"]["max_requests"] = "4"
+        self.cfg["DEFAULT"]["requests_per_hour"] = "200"
+        self.cfg["DEFAULT"]["request_burst"] = "10"
+        self.cfg["DEFAULT"]["request_timeout"] = "15"
+        self.cfg["DEFAULT"]["use_catalog"] = "False"
+        self.cfg["DEFAULT"]["catalog_max_age_days"] = "7"
+        self.cfg["DEFAULT"]["emu_fullscreen"] = "False"
+        self.cfg["DEFAULT"]["extract_cache_mb"] = "256"
+        self.cfg["DEFAULT"]["launch_timeout"] = "3"
+        self.cfg["DEFAULT"]["detect_external_launches"] = "True"
+        self.cfg["DEFAULT"]["discovery_interval"] = "5"
+        self.cfg["DEFAULT"]["scan_workers"] = "8"
+        self.cfg["DEFAULT"]["watch_interval"] = "1"
         
         self.cfg.add_section("Paths")
         self.cfg.set("Paths", textwrap.dedent(
                 """\
-                ; Set your roms folder, path to your Mesen.exe here\
+                ; Set your roms folder, path to your Mesen.exe here
+                ; dat_path: Folder of No-Intro/TOSEC DAT files, roms found in them are named without asking Giant Bomb
+                ; scan_workers: Number of folders listed at the same time, raise it for network shares
+                ; watch_interval: Seconds between checks for new or removed roms where the folder cannot be watched\
                 """
             )
         )
@@ -23,7 +137,12 @@ class Config:
         self.cfg.add_section("Method")
         self.cfg.set("Method", textwrap.dedent(
                 """\
-                ; Set your API key here\
+                ; Set your API key here
+                ; max_requests: Number of Giant Bomb searches sent at the same time
+                ; requests_per_hour, request_burst: Pace of Giant Bomb searches, keep them within your API limits
+                ; request_timeout: Seconds before a Giant Bomb request is given up and tried again
+                ; use_catalog: Set to True to download the whole NES game list once and match roms locally instead of searching each one
+                ; catalog_max_age_days: Days before the game list is downloaded again\
                 """
             )
         )
@@ -31,7 +150,63 @@ class Config:
         self.cfg.add_section("EmuSettings")
         self.cfg.set("EmuSettings", textwrap.dedent(
                 """\
-                ; emu_fullscreen: Set to True if you want to launch in fullscreen by default\
+                ; emu_fullscreen: Set to True if you want to launch in fullscreen by default
+                ; extract_cache_mb: Space kept for roms extracted from zip files to launch them
+                ; launch_timeout: Seconds Mesen has to keep running, exiting with an error sooner reports the launch as failed
+                ; detect_external_launches: Set to False to only count play time of games launched from Galaxy
+                ; discovery_interval: Seconds between looks for games started from Mesen itself or another frontend\
                 """
             )
-        )
\ No newline at end of file
+        )
+
+        self.path = os.path.expandvars(CONFIG_LOC)
+        self.settings = Settings.from_parser(self.cfg)
+        self._stamp = None
+        self._subscribers = []
+        self._lock = threading.Lock()
+
+
+    def snapshot(self) -> Settings:
+        ''' Returns the current Settings
+
+        config.ini is only read again when its mtime or size changed since the last snapshot.
+        A file that cannot be read or holds invalid values is logged and the previous Settings are kept.
+        '''
+        try:
+            stat = os.stat(self.path)
+            stamp = (stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            stamp = None
+        if stamp == self._stamp:
+            return self.settings
+
+        with self._lock:
+            if stamp == self._stamp:
+                return self.settings
+            old = self.settings
+            parser = configparser.ConfigParser(allow_no_value=True)
+            parser.read_dict(self.cfg)
+            try:
+                if stamp is not None:
+                    parser.read(self.path, encoding="utf-8")
+                new = Settings.from_parser(parser)
+            except (configparser.Error, ValueError, UnicodeDecodeError):
+                logging.exception("DEV: Failed to read config, keeping the previous settings")
+                new = old
+            self._stamp = stamp
+            self.settings = new
+
+        if new != old:
+            logging.debug("DEV: Config has changed - %s", new)
+            for callback in list(self._subscribers):
+                callback(old, new)
+        return new
+
+
+    def subscribe(self, callback) -> None:
+        ''' Returns None
+
+        Calls callback(old, new) with the old and new Settings whenever config.ini changes,
+        from the thread that took the snapshot
+        '''
+        self._subscribers.append(callback)
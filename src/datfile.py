@@ -0,0 +1,169 @@
+import hashlib
+import logging
+import os
+import struct
+import threading
+import xml.etree.ElementTree as ElementTree
+
+from normalize import parse_rom_name, title_key
+
+DAT_EXTENSIONS = (".dat", ".xml")
+SNAPSHOT_MAGIC = b"NESDAT02"
+_SNAPSHOT_HEADER = struct.Struct("<8s32sII")
+_SNAPSHOT_RECORD = struct.Struct("<I20sI")
+_NO_SHA1 = bytes(20)
+DAT_ID_PREFIX = "dat:"
+
+
+def dat_title(name) -> str:
+    ''' Returns the title of a DAT entry without its region and dump tags'''
+    return parse_rom_name(name).title
+
+
+def dat_game_id(title) -> str:
+    ''' Returns the Galaxy game id of a DAT title, the same for every dump and release of the game'''
+    return DAT_ID_PREFIX + title_key(title)
+
+
+class DatIndex:
+    ''' Index of No-Intro/TOSEC style XML DAT files mapping rom hashes to titles
+
+    The parsed index is kept as a binary snapshot that is only rebuilt when a DAT file changes.
+    Snapshot layout: header (magic, sha256 fingerprint of the DAT folder, title count, record count),
+    titles as length-prefixed utf-8, then fixed size (crc32, sha1, title number) records.
+    '''
+    def __init__(self, snapshot_path):
+        self.snapshot_path = snapshot_path
+        self.fingerprint = None
+        self.titles = []
+        self.records = []  # (crc32, sha1 bytes, title number)
+        self.by_sha1 = {}  # sha1 bytes -> title number
+        self.by_crc32 = {}  # crc32 int -> title number
+        self._title_numbers = {}
+        self._lock = threading.Lock()
+
+
+    def load(self, dat_dir) -> None:
+        ''' Returns None
+
+        Loads the index of the DAT files in dat_dir, from the snapshot if it is up to date
+        '''
+        with self._lock:
+            dat_files = self._dat_files(dat_dir)
+            fingerprint = self._fingerprint(dat_files)
+            if fingerprint == self.fingerprint:
+                return
+
+            self._clear()
+            if dat_files and not self._read_snapshot(fingerprint):
+                for path in dat_files:
+                    self._parse(path)
+                self._write_snapshot(fingerprint)
+            self.fingerprint = fingerprint
+            logging.debug("DEV: DAT index has %d titles and %d roms", len(self.titles), len(self.by_crc32))
+
+
+    def lookup(self, rom_hash) -> str:
+        ''' Returns the DAT title of a RomHash, None if no DAT knows it'''
+        if rom_hash.sha1 is not None:
+            title = self.by_sha1.get(bytes.fromhex(rom_hash.sha1))
+        else:
+            title = self.by_crc32.get(int(rom_hash.crc32, 16))
+        return self.titles[title] if title is not None else None
+
+
+    def _clear(self) -> None:
+        self.fingerprint = None
+        self.titles = []
+        self.records = []
+        self.by_sha1 = {}
+        self.by_crc32 = {}
+        self._title_numbers = {}
+
+
+    @staticmethod
+    def _dat_files(dat_dir) -> list:
+        if not dat_dir or not os.path.isdir(dat_dir):
+            return []
+        with os.scandir(dat_dir) as entries:
+            return sorted(entry.path for entry in entries if entry.is_file() and entry.name.lower().endswith(DAT_EXTENSIONS))
+
+
+    @staticmethod
+    def _fingerprint(dat_files) -> bytes:
+        digest = hashlib.sha256()
+        for path in dat_files:
+            stat = os.stat(path)
+            digest.update("{}\0{}\0{}\0".format(path, stat.st_size, stat.st_mtime).encode("utf-8"))
+        return digest.digest()
+
+
+    def _add_record(self, crc32, sha1, number) -> None:
+        self.records.append((crc32, sha1, number))
+        if sha1 != _NO_SHA1:
+            self.by_sha1.setdefault(sha1, number)
+        self.by_crc32.setdefault(crc32, number)
+
+
+    def _parse(self, path) -> None:
+        ''' Returns None
+
+        Streams the rom entries of a DAT file into the index, a broken file is logged and skipped
+        '''
+        try:
+            for _, element in ElementTree.iterparse(path):
+                if element.tag not in ("game", "machine"):
+                    continue
+                title = dat_title(element.get("name", ""))
+                number = self._title_numbers.setdefault(title, len(self.titles))
+                if number == len(self.titles):
+                    self.titles.append(title)
+                for rom in element.iter("rom"):
+                    crc32 = rom.get("crc")
+                    if not crc32:
+                        continue
+                    sha1 = rom.get("sha1")
+                    self._add_record(int(crc32, 16), bytes.fromhex(sha1) if sha1 else _NO_SHA1, number)
+                element.clear()
+        except (OSError, ElementTree.ParseError, ValueError):
+            logging.exception("DEV: Failed to parse DAT file - %s", path)
+
+
+    def _read_snapshot(self, fingerprint) -> bool:
+        try:
+            with open(self.snapshot_path, "rb") as snapshot:
+                data = snapshot.read()
+            magic, snapshot_fingerprint, title_count, record_count = _SNAPSHOT_HEADER.unpack_from(data)
+            if magic != SNAPSHOT_MAGIC or snapshot_fingerprint != fingerprint:
+                return False
+
+            offset = _SNAPSHOT_HEADER.size
+            titles = []
+            for _ in range(title_count):
+                length, = struct.unpack_from("<H", data, offset)
+                titles.append(data[offset + 2:offset + 2 + length].decode("utf-8"))
+                offset += 2 + length
+            self.titles = titles
+            for record in _SNAPSHOT_RECORD.iter_unpack(data[offset:offset + record_count * _SNAPSHOT_RECORD.size]):
+                self._add_record(*record)
+            return True
+        except FileNotFoundError:
+            return False
+        except (struct.error, UnicodeDecodeError):
+            logging.exception("DEV: DAT snapshot is corrupt, DAT files will be parsed again")
+            self._clear()
+            return False
+
+
+    def _write_snapshot(self, fingerprint) -> None:
+        if not os.path.isdir(os.path.dirname(self.snapshot_path)):
+            os.makedirs(os.path.dirname(self.snapshot_path))
+
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "wb") as snapshot:
+            snapshot.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, fingerprint, len(self.titles), len(self.records)))
+            for title in self.titles:
+                encoded = title.encode("utf-8")
+                snapshot.write(struct.pack("<H", len(encoded)) + encoded)
+            snapshot.write(b"".join(_SNAPSHOT_RECORD.pack(*record) for record in self.records))
+        os.replace(tmp_path, self.snapshot_path)
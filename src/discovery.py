@@ -0,0 +1,177 @@
+import logging
+import os
+import sys
+from typing import Optional
+
+from archives import split_member
+from galaxy.proc_tools import pids
+
+
+if sys.platform == "win32":
+    from ctypes import (POINTER, Structure, byref, c_int, c_long, c_ulong, c_ushort, c_void_p, c_wchar_p,
+                        create_string_buffer, windll, wstring_at)
+
+    _PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+    _PROCESS_COMMAND_LINE_INFORMATION = 60
+    _STATUS_INFO_LENGTH_MISMATCH = -0x3FFFFFFC
+
+
+    class _UnicodeString(Structure):
+        _fields_ = [("length", c_ushort), ("maximum_length", c_ushort), ("buffer", c_void_p)]
+
+
+    windll.ntdll.NtQueryInformationProcess.restype = c_long
+    windll.shell32.CommandLineToArgvW.argtypes = [c_wchar_p, POINTER(c_int)]
+    windll.shell32.CommandLineToArgvW.restype = POINTER(c_wchar_p)
+    windll.kernel32.LocalFree.argtypes = [c_void_p]
+
+
+    def read_cmdline(pid) -> Optional[list]:
+        ''' Returns the command line arguments of a process, None if they cannot be read
+
+        Asks for the command line directly, which needs Windows 8.1 or newer, and splits it the way the process did
+        '''
+        h_process = windll.kernel32.OpenProcess(_PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+        if not h_process:
+            return None
+        try:
+            size = c_ulong(1024)
+            while True:
+                buffer = create_string_buffer(size.value)
+                status = windll.ntdll.NtQueryInformationProcess(
+                    h_process, _PROCESS_COMMAND_LINE_INFORMATION, buffer, len(buffer), byref(size)
+                )
+                if status != _STATUS_INFO_LENGTH_MISMATCH or size.value <= len(buffer):
+                    break
+            if status != 0:
+                return None
+            command_line = _UnicodeString.from_buffer(buffer)
+            if not command_line.buffer:
+                return []
+            command_line = wstring_at(command_line.buffer, command_line.length // 2)
+        finally:
+            windll.kernel32.CloseHandle(h_process)
+
+        count = c_int()
+        argv = windll.shell32.CommandLineToArgvW(command_line, byref(count))
+        if not argv:
+            return None
+        try:
+            return [argv[i] for i in range(count.value)]
+        finally:
+            windll.kernel32.LocalFree(argv)
+elif os.path.isdir("/proc"):
+    def read_cmdline(pid) -> Optional[list]:
+        ''' Returns the command line arguments of a process, None if they cannot be read
+
+        Read straight from /proc, no process object is created
+        '''
+        try:
+            with open("/proc/{}/cmdline".format(pid), "rb") as cmdline:
+                data = cmdline.read()
+        except OSError:
+            return None
+        return [os.fsdecode(arg) for arg in data.split(b"\0")[:-1]]
+else:
+    import psutil
+
+
+    def read_cmdline(pid) -> Optional[list]:
+        ''' Returns the command line arguments of a process, None if they cannot be read'''
+        try:
+            return psutil.Process(pid).cmdline()
+        except psutil.Error:
+            return None
+
+
+def path_key(path) -> str:
+    ''' Returns the key of a path in a PathIndex, equal for every spelling of the same path'''
+    return os.path.normcase(os.path.abspath(path))
+
+
+class PathIndex:
+    ''' Maps the paths an emulator may be given for a rom back to the id of its game
+
+    Plain roms are indexed under their path, roms in an archive under the archive,
+    when it holds only that rom, and under the file they are extracted to for launching.
+    '''
+    def __init__(self, games, roms, extract_path):
+        self.paths = {}
+        archives = {}
+        for game in games:
+            archive_path, member = split_member(game.path)
+            if member is None:
+                self.paths[path_key(game.path)] = game.id
+                continue
+            rom = roms.get(game.path)
+            if rom is None:
+                # Deleted, its game is about to be removed
+                continue
+            archives.setdefault(archive_path, []).append(game.id)
+            extracted = os.path.join(extract_path, "{}_{}".format(rom[2], os.path.basename(member)))
+            self.paths[path_key(extracted)] = game.id
+        for archive_path, game_ids in archives.items():
+            if len(game_ids) == 1:
+                self.paths[path_key(archive_path)] = game_ids[0]
+
+
+    def find(self, args) -> Optional[str]:
+        ''' Returns the id of the game of the first argument that is the path of a known rom, None if there is none'''
+        for arg in args:
+            if os.path.isabs(arg):
+                game_id = self.paths.get(path_key(arg))
+                if game_id is not None:
+                    return game_id
+        return None
+
+
+class ProcessDiscovery:
+    ''' Finds emulators that were started outside of Galaxy and the games they run
+
+    The pids of the previous scan are kept, so only processes that appeared since then have their command
+    line read. A process caught while it is still starting has no command line yet, it is read once more
+    in the next scan. A process is taken for the emulator when its program, or the first argument given
+    to a runtime such as mono, has the file name of the configured emulator.
+    '''
+    def __init__(self, list_pids=pids, read_cmdline=read_cmdline):
+        self.list_pids = list_pids
+        self.read_cmdline = read_cmdline
+        self.seen = {}  # pid -> game id of the emulators found, None for other processes
+        self.unread = set()  # pids whose command line could not be read in the previous scan
+
+
+    def scan(self, emu_path, index, ignored=()) -> tuple:
+        ''' Returns ({pid: game id} of emulators that started, list of pids of emulators that exited) since the last scan
+
+        Processes in ignored, the emulators already tracked, are skipped
+        '''
+        current = set(self.list_pids())
+        stopped = []
+        for pid in set(self.seen) - current:
+            if self.seen.pop(pid) is not None:
+                stopped.append(pid)
+
+        started = {}
+        unread = set()
+        emu_name = os.path.normcase(os.path.basename(emu_path or ""))
+        retried = self.unread & current
+        for pid in (current - set(self.seen)) | retried:
+            game_id = None
+            if emu_name and pid not in ignored:
+                args = self.read_cmdline(pid)
+                if args:
+                    game_id = self._find_game(args, emu_name, index)
+                elif pid not in retried:
+                    unread.add(pid)
+            self.seen[pid] = game_id
+            if game_id is not None:
+                logging.debug("DEV: Found emulator started outside of Galaxy with game - %s", game_id)
+                started[pid] = game_id
+        self.unread = unread
+        return started, stopped
+
+
+    def _find_game(self, args, emu_name, index) -> Optional[str]:
+        if not any(os.path.normcase(os.path.basename(arg)) == emu_name for arg in args[:2]):
+            return None
+        return index.find(args[1:])
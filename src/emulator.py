@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import subprocess
+from collections import deque
+from typing import Optional
+
+from metrics import metrics
+
+DEFAULT_LAUNCH_TIMEOUT = 3
+STDERR_LINES = 200
+# Seconds given to the stderr reader to drain the pipe after the emulator exited
+STDERR_DRAIN_TIMEOUT = 1
+
+
+class LaunchError(Exception):
+    ''' The emulator could not be started'''
+
+
+class EmulatorProcess:
+    ''' A running emulator whose exit is awaited instead of polled
+
+    The last STDERR_LINES lines the emulator writes to stderr are kept for diagnostics.
+    '''
+    def __init__(self, process, stderr_lines=STDERR_LINES):
+        self.process = process
+        self.pid = process.pid
+        self.stderr = deque(maxlen=stderr_lines)
+        self._reader = asyncio.ensure_future(self._read_stderr())
+
+
+    async def wait(self) -> int:
+        ''' Returns the exit code of the emulator once it has exited'''
+        returncode = await self.process.wait()
+        # A process started by the emulator may keep the pipe open, so the reader is not waited on for long
+        await asyncio.wait([self._reader], timeout=STDERR_DRAIN_TIMEOUT)
+        self._reader.cancel()
+        return returncode
+
+
+    async def exited_within(self, timeout) -> Optional[int]:
+        ''' Returns the exit code if the emulator exits within timeout seconds, None if it is still running'''
+        exited = asyncio.ensure_future(self.process.wait())
+        await asyncio.wait([exited], timeout=timeout)
+        if not exited.done():
+            exited.cancel()
+            return None
+        return exited.result()
+
+
+    def stderr_tail(self) -> str:
+        ''' Returns the lines of stderr kept in the ring buffer'''
+        return "\n".join(self.stderr)
+
+
+    async def _read_stderr(self) -> None:
+        while True:
+            line = await self.process.stderr.readline()
+            if not line:
+                return
+            self.stderr.append(line.decode("utf-8", "replace").rstrip())
+
+
+async def launch(args, timeout=DEFAULT_LAUNCH_TIMEOUT, on_started=None) -> EmulatorProcess:
+    ''' Returns the started emulator once it kept running for timeout seconds or exited without an error
+
+    Raises LaunchError if the process cannot be created or exits with an error within timeout seconds.
+    Creating the process has no deadline, cancelling it could leave an emulator running that nobody tracks.
+    on_started is called with the pid as soon as the process exists.
+    '''
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+    except (OSError, ValueError) as error:
+        metrics.increment("emulator.launch_failed")
+        raise LaunchError("Emulator could not be started - %s" % error) from error
+
+    logging.debug("DEV: Emulator has been started with pid - %d", process.pid)
+    emulator = EmulatorProcess(process)
+    if on_started is not None:
+        on_started(process.pid)
+    returncode = await emulator.exited_within(timeout)
+    if returncode:
+        await emulator.wait()
+        metrics.increment("emulator.launch_failed")
+        raise LaunchError("Emulator exited with code %d right after it started - %s" % (returncode, emulator.stderr_tail()))
+
+    metrics.increment("emulator.launched")
+    return emulator
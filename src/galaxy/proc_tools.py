@@ -1,6 +1,7 @@
+import os
 import sys
-from dataclasses import dataclass
-from typing import Iterable, NewType, Optional, List, cast
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, NewType, Optional, List, Tuple, cast
 
 
 ProcessId = NewType("ProcessId", int)
@@ -12,6 +13,46 @@ class ProcessInfo:
     binary_path: Optional[str]
 
 
+@dataclass
+class ProcessSnapshot:
+    """Processes running at one moment, stored column-wise: binary_paths[i] is the binary of pids[i]."""
+    pids: Tuple[ProcessId, ...]
+    binary_paths: Tuple[Optional[str], ...]
+    _by_pid: Optional[Dict[ProcessId, Optional[str]]] = field(default=None, init=False, repr=False, compare=False)
+
+    def __len__(self) -> int:
+        return len(self.pids)
+
+    def __iter__(self) -> Iterator[ProcessInfo]:
+        for pid, binary_path in zip(self.pids, self.binary_paths):
+            yield ProcessInfo(pid=pid, binary_path=binary_path)
+
+    def __contains__(self, pid: object) -> bool:
+        return pid in self._index()
+
+    def binary_path(self, pid: ProcessId) -> Optional[str]:
+        return self._index().get(pid)
+
+    def diff(self, previous: "ProcessSnapshot") -> Tuple[List[ProcessId], List[ProcessId]]:
+        """Returns (started, exited) pids since the previous snapshot.
+        A pid reused by another binary in between counts as both."""
+        current = self._index()
+        old = previous._index()
+        started = [pid for pid, binary_path in current.items() if pid not in old or old[pid] != binary_path]
+        exited = [pid for pid, binary_path in old.items() if pid not in current or current[pid] != binary_path]
+        return started, exited
+
+    @classmethod
+    def from_process_infos(cls, process_infos: Iterable[Optional[ProcessInfo]]) -> "ProcessSnapshot":
+        infos = [info for info in process_infos if info is not None]
+        return cls(tuple(info.pid for info in infos), tuple(info.binary_path for info in infos))
+
+    def _index(self) -> Dict[ProcessId, Optional[str]]:
+        if self._by_pid is None:
+            self._by_pid = dict(zip(self.pids, self.binary_paths))
+        return self._by_pid
+
+
 if sys.platform == "win32":
     from ctypes import byref, sizeof, windll, create_unicode_buffer, FormatError, WinError
     from ctypes.wintypes import DWORD
@@ -63,6 +104,10 @@ if sys.platform == "win32":
         finally:
             windll.kernel32.CloseHandle(h_process)
             return process_info
+
+
+    def process_snapshot() -> ProcessSnapshot:
+        return ProcessSnapshot.from_process_infos(get_process_info(pid) for pid in pids())
 else:
     import psutil
 
@@ -82,6 +127,39 @@ else:
             return process_info
 
 
+    def _scan_procfs(procfs_path: str) -> ProcessSnapshot:
+        """Reads the binary of every process in a single pass over procfs, without a psutil.Process per pid."""
+        proc_ids: List[ProcessId] = []
+        binary_paths: List[Optional[str]] = []
+        with os.scandir(procfs_path) as entries:
+            for entry in entries:
+                if not entry.name.isdigit():
+                    continue
+                binary_path: Optional[str]
+                try:
+                    binary_path = os.readlink(entry.path + "/exe").rstrip("\0")
+                    if binary_path.endswith(" (deleted)") and not os.path.exists(binary_path):
+                        binary_path = binary_path[:-len(" (deleted)")]
+                except FileNotFoundError:
+                    if not os.path.lexists(entry.path):
+                        # exited during the scan
+                        continue
+                    # kernel threads have no binary
+                    binary_path = ""
+                except PermissionError:
+                    binary_path = None
+                except OSError:
+                    continue
+                proc_ids.append(ProcessId(int(entry.name)))
+                binary_paths.append(binary_path)
+        return ProcessSnapshot(tuple(proc_ids), tuple(binary_paths))
+
+
+    def process_snapshot() -> ProcessSnapshot:
+        if sys.platform.startswith("linux") and os.path.isdir(psutil.PROCFS_PATH):
+            return _scan_procfs(psutil.PROCFS_PATH)
+        return ProcessSnapshot.from_process_infos(get_process_info(pid) for pid in pids())
+
+
 def process_iter() -> Iterable[Optional[ProcessInfo]]:
-    for pid in pids():
-        yield get_process_info(pid)
+    return iter(process_snapshot())
@@ -0,0 +1,248 @@
+import json
+import logging
+import os
+import threading
+
+SNAPSHOT_VERSION = 3
+COMPACT_AFTER = 100
+
+# Finished sessions written by earlier versions, still applied when an old journal is replayed
+ENTRY_SESSION = "session"
+ENTRY_OPEN = "open"
+ENTRY_CHECKPOINT = "checkpoint"
+ENTRY_CLOSE = "close"
+
+
+def _fsync_dir(path) -> None:
+    # Makes a rename durable, directories cannot be opened for this on Windows
+    if hasattr(os, "O_DIRECTORY"):
+        fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class GameTimeStore:
+    ''' Play time of every game, kept in memory and persisted as a snapshot plus an append-only journal
+
+    Play time is counted in seconds, time_played holds the whole minutes Galaxy shows.
+    A finished session, or a checkpoint of a running one, is one line appended to the journal and synced,
+    it never rewrites the snapshot. Every COMPACT_AFTER entries the table is written to a new snapshot
+    that atomically replaces the old one. Journal lines carry increasing sequence numbers and the snapshot
+    the last one it contains, so play time is neither lost nor counted twice when a crash interrupts
+    a write or a compaction. Sessions that were opened and not closed yet are kept in sessions.
+    '''
+    def __init__(self, path, journal_path, compact_after=COMPACT_AFTER):
+        self.path = path
+        self.journal_path = journal_path
+        self.compact_after = compact_after
+        self.times = {}  # game id -> {"name", "time_played", "seconds_played", "last_time_played"}
+        self.sessions = {}  # session id -> {"id", "pid", "started", "seconds"} of sessions that are not closed
+        self.sequence = 0
+        self.snapshot_sequence = 0
+        self.dirty = False
+        self.changed = set()  # game ids whose time changed since the last take_changed
+        self._lock = threading.Lock()
+        self.load()
+
+
+    def load(self) -> None:
+        ''' Returns None
+
+        Reads the snapshot and replays the sessions of the journal that are not in it.
+        A journal line cut short by a crash is dropped.
+        '''
+        try:
+            with open(self.path, encoding="utf-8") as snapshot_file:
+                data = json.load(snapshot_file)
+            if data.get("version") in (2, SNAPSHOT_VERSION):
+                self.times = data["games"]
+                self.sessions = data.get("sessions", {})
+                self.snapshot_sequence = data["sequence"]
+            else:
+                # game_times.json of older versions only holds the games
+                self.times = data
+            for times in self.times.values():
+                times.setdefault("seconds_played", times["time_played"] * 60)
+            self.sequence = self.snapshot_sequence
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, AttributeError, TypeError):
+            logging.exception("DEV: Game times snapshot is corrupt, only the journal is used")
+            self.times = {}
+            self.sessions = {}
+
+        for entry in self._read_journal():
+            if entry["seq"] > self.snapshot_sequence:
+                self._apply(entry)
+            self.sequence = max(self.sequence, entry["seq"])
+
+
+    def get(self, game_id) -> dict:
+        ''' Returns the entry of a game with its time played in minutes and seconds and last time played, None if it has none'''
+        return self.times.get(game_id)
+
+
+    def add(self, game_id, name) -> None:
+        ''' Returns None
+
+        Adds a game that was never played, it is stored with the next compaction
+        '''
+        with self._lock:
+            if game_id not in self.times:
+                self.times[game_id] = { "name": name, "time_played": 0, "seconds_played": 0, "last_time_played": None }
+                self.dirty = True
+                self.changed.add(game_id)
+
+
+    def take_changed(self) -> set:
+        ''' Returns the set of game ids whose time changed since the previous call'''
+        with self._lock:
+            changed, self.changed = self.changed, set()
+        return changed
+
+
+    def mark_sent(self, game_ids) -> None:
+        ''' Returns None
+
+        Forgets the changes of games whose time was sent to Galaxy outside of take_changed
+        '''
+        with self._lock:
+            self.changed.difference_update(game_ids)
+
+
+    def open_session(self, session_id, game_id, pid, started) -> None:
+        ''' Returns None
+
+        Records that a session of a game started in the emulator process pid
+        '''
+        self._record({ "type": ENTRY_OPEN, "session": session_id, "id": game_id, "pid": pid, "last": started })
+
+
+    def checkpoint(self, session_id, seconds, now) -> dict:
+        ''' Returns the updated entry of the game
+
+        Adds the seconds a running session was played since its previous checkpoint
+        '''
+        return self._record({ "type": ENTRY_CHECKPOINT, "session": session_id,
+            "id": self.sessions[session_id]["id"], "seconds": seconds, "last": now })
+
+
+    def close_session(self, session_id, seconds, now) -> dict:
+        ''' Returns the updated entry of the game
+
+        Adds the last seconds of a session and closes it
+        '''
+        return self._record({ "type": ENTRY_CLOSE, "session": session_id,
+            "id": self.sessions[session_id]["id"], "seconds": seconds, "last": now })
+
+
+    def _record(self, entry) -> dict:
+        ''' Returns the entry of the game after appending entry to the journal, syncing it and applying it'''
+        with self._lock:
+            self.sequence += 1
+            entry = dict(entry, seq=self.sequence)
+            if entry.get("name") is None:
+                entry.pop("name", None)
+            self._append(entry)
+            self._apply(entry)
+            self.changed.add(entry["id"])
+            compact = self.sequence - self.snapshot_sequence >= self.compact_after
+        if compact:
+            self.compact()
+        return self.times[entry["id"]]
+
+
+    def compact(self) -> None:
+        ''' Returns None
+
+        Writes the table to a synced snapshot that replaces the old one, then empties the journal
+        '''
+        with self._lock:
+            if self.sequence == self.snapshot_sequence and not self.dirty:
+                return
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as snapshot_file:
+                json.dump({ "version": SNAPSHOT_VERSION, "sequence": self.sequence, "games": self.times,
+                    "sessions": self.sessions }, snapshot_file)
+                snapshot_file.flush()
+                os.fsync(snapshot_file.fileno())
+            os.replace(tmp_path, self.path)
+            _fsync_dir(os.path.dirname(self.path))
+            self.snapshot_sequence = self.sequence
+            self.dirty = False
+
+            # Sessions left in the journal are already in the snapshot, so losing this truncation is harmless
+            with open(self.journal_path, "w", encoding="utf-8"):
+                pass
+        logging.debug("DEV: Game times compacted at session %d", self.sequence)
+
+
+    def _apply(self, entry) -> None:
+        times = self.times.setdefault(entry["id"],
+            { "name": entry.get("name"), "time_played": 0, "seconds_played": 0, "last_time_played": None })
+        if entry.get("name") is not None:
+            times["name"] = entry["name"]
+
+        kind = entry.get("type", ENTRY_SESSION)
+        if kind == ENTRY_OPEN:
+            self.sessions[entry["session"]] = { "id": entry["id"], "pid": entry["pid"], "started": entry["last"],
+                "seconds": 0 }
+            return
+        if kind in (ENTRY_CHECKPOINT, ENTRY_CLOSE):
+            session = self.sessions.get(entry["session"])
+            if session is None:
+                return
+            session["seconds"] += entry["seconds"]
+            if kind == ENTRY_CLOSE:
+                del self.sessions[entry["session"]]
+
+        times["seconds_played"] += entry["seconds"]
+        times["time_played"] = times["seconds_played"] // 60
+        times["last_time_played"] = entry["last"]
+
+
+    def _append(self, entry) -> None:
+        if not os.path.isdir(os.path.dirname(self.journal_path)):
+            os.makedirs(os.path.dirname(self.journal_path))
+        with open(self.journal_path, "a", encoding="utf-8") as journal:
+            journal.write(json.dumps(entry) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+
+
+    def _read_journal(self) -> list:
+        ''' Returns the list of complete journal entries
+
+        A trailing partial line is cut off so the next session starts on a line of its own
+        '''
+        try:
+            with open(self.journal_path, "rb") as journal:
+                data = journal.read()
+        except FileNotFoundError:
+            return []
+
+        complete = data[:data.rfind(b"\n") + 1]
+        if len(complete) != len(data):
+            logging.warning("DEV: Dropping an incomplete game time journal entry")
+            with open(self.journal_path, "r+b") as journal:
+                journal.truncate(len(complete))
+
+        entries = []
+        for line in complete.splitlines():
+            try:
+                entry = json.loads(line.decode("utf-8"))
+                if "id" not in entry:
+                    raise KeyError("id")
+                entry["seq"] = int(entry["seq"])
+                if "minutes" in entry:
+                    # Sessions journaled before play time was counted in seconds
+                    entry["seconds"] = entry.pop("minutes") * 60
+                entries.append(entry)
+            except (ValueError, KeyError, TypeError, UnicodeDecodeError):
+                logging.warning("DEV: Skipping an unreadable game time journal entry")
+        return entries
@@ -0,0 +1,263 @@
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Optional
+
+import aiohttp
+
+from galaxy.api.errors import (BackendError, BackendNotAvailable, BackendTimeout, InvalidCredentials, NetworkError,
+                               TooManyRequests, UnknownBackendResponse)
+from galaxy.http import create_client_session, create_tcp_connector, handle_exception
+from metrics import metrics
+from ratelimit import PRIORITY_NORMAL, RateLimiter
+from resilience import CircuitBreaker, backoff_delay
+from singleflight import SingleFlight
+from version import __version__
+
+SEARCH_URL = "https://www.giantbomb.com/api/search/"
+GAMES_URL = "https://www.giantbomb.com/api/games/"
+NES_PLATFORM_ID = 21
+# Largest page the games resource returns
+GAMES_PAGE_SIZE = 100
+DEFAULT_MAX_REQUESTS = 4
+# Giant Bomb allows 200 requests per resource per hour
+DEFAULT_REQUESTS_PER_HOUR = 200
+DEFAULT_BURST = 10
+# Seconds a single request may take, instead of the session's 60 second default
+DEFAULT_REQUEST_TIMEOUT = 15
+DEFAULT_RETRIES = 3
+# Failures that are retried with backoff, all of them count towards opening the circuit breaker
+_BACKOFF_ERRORS = (BackendTimeout, BackendNotAvailable)
+_BACKEND_FAILURES = _BACKOFF_ERRORS + (BackendError, NetworkError)
+# Giant Bomb answers 420 when its velocity detection kicks in
+_THROTTLED_STATUSES = (420, 429)
+# Giant Bomb reports errors in the status_code field of an otherwise successful response
+_STATUS_OK = 1
+_STATUS_INVALID_API_KEY = 100
+_STATUS_RATE_LIMITED = 107
+
+
+@contextmanager
+def handle_throttling():
+    '''
+    Context manager raising TooManyRequests with the Retry-After seconds as data
+    for the throttling statuses Giant Bomb uses.
+    '''
+    try:
+        yield
+    except aiohttp.ClientResponseError as error:
+        if error.status not in _THROTTLED_STATUSES:
+            raise
+        headers = getattr(error, "headers", None) or {}
+        raise TooManyRequests({ "retry_after": headers.get("Retry-After") })
+
+
+def check_response(data, headers=None) -> dict:
+    ''' Returns the data of a Giant Bomb response, raising galaxy.api.errors exceptions for error responses
+
+    headers are the response headers, a rate limited response may carry Retry-After
+    '''
+    if not isinstance(data, dict):
+        raise UnknownBackendResponse("Response is not an object")
+    status = data.get("status_code", _STATUS_OK)
+    if status == _STATUS_INVALID_API_KEY:
+        raise InvalidCredentials(data.get("error"))
+    if status == _STATUS_RATE_LIMITED:
+        raise TooManyRequests({ "retry_after": (headers or {}).get("Retry-After") })
+    if status != _STATUS_OK:
+        raise UnknownBackendResponse(data.get("error"))
+    return data
+
+
+def require_api_key(api_key) -> None:
+    ''' Returns None if an API key is set, raises InvalidCredentials otherwise'''
+    if not api_key:
+        raise InvalidCredentials({ "api_key": "missing" })
+
+
+def query_key(query) -> str:
+    ''' Returns the key under which searches for a query are shared'''
+    return " ".join(query.lower().split())
+
+
+class GiantBombClient:
+    ''' Asynchronous client for the Giant Bomb search API
+
+    All requests share one session and connector, at most max_requests of them are in flight at a time
+    and they are paced by a RateLimiter. Every request has a deadline of request_timeout seconds,
+    timeouts and unavailable responses are retried with jittered exponential backoff and a CircuitBreaker
+    stops sending requests while Giant Bomb keeps failing. Network errors are raised as galaxy.api.errors exceptions.
+    '''
+    HEADERS = {
+        "User-Agent": "galaxy-integration-nes/" + __version__,
+    }
+
+    def __init__(self, max_requests=DEFAULT_MAX_REQUESTS, rate_limiter=None, breaker=None,
+            request_timeout=DEFAULT_REQUEST_TIMEOUT, retries=DEFAULT_RETRIES):
+        self.max_requests = max_requests
+        self.rate_limiter = rate_limiter or RateLimiter(DEFAULT_REQUESTS_PER_HOUR / 3600, DEFAULT_BURST)
+        self.breaker = breaker or CircuitBreaker("giant_bomb.breaker")
+        self.request_timeout = request_timeout
+        self.retries = retries
+        self.searches = SingleFlight("giant_bomb.searches")
+        self.downloads = SingleFlight("giant_bomb.downloads")
+        self._session = None
+        self._semaphore = None
+
+
+    def set_max_requests(self, max_requests) -> None:
+        ''' Returns None
+
+        Requests already in flight finish under the old limit, later ones wait on a semaphore of the new size
+        '''
+        if max_requests != self.max_requests:
+            self.max_requests = max_requests
+            self._semaphore = None
+
+
+    async def search(self, api_key, query, priority=PRIORITY_NORMAL) -> Optional[dict]:
+        ''' Returns the id and name of the first game found for query, None if nothing was found
+
+        Requests with a lower priority value are sent first when the rate limit is reached.
+        Concurrent searches for the same query share one request.
+        '''
+        require_api_key(api_key)
+        return await self.searches.do(
+            query_key(query),
+            lambda: self._call(lambda: self._search(api_key, query), priority)
+        )
+
+
+    async def platform_games(self, api_key, priority=PRIORITY_NORMAL) -> list:
+        ''' Returns a list of the id, name and aliases of every NES game on Giant Bomb
+
+        The list is downloaded page by page, one request per GAMES_PAGE_SIZE games.
+        Concurrent downloads share the same requests.
+        '''
+        require_api_key(api_key)
+        return await self.downloads.do(NES_PLATFORM_ID, lambda: self._platform_games(api_key, priority))
+
+
+    async def _platform_games(self, api_key, priority) -> list:
+        games = []
+        offset = 0
+        total = None
+        while total is None or offset < total:
+            page = await self._call(lambda: self._games_page(api_key, offset), priority)
+            results = page.get("results") or []
+            total = page.get("number_of_total_results", 0)
+            for result in results:
+                aliases = result.get("aliases")
+                games.append({
+                    "id": result["id"],
+                    "name": result["name"],
+                    "aliases": aliases.splitlines() if aliases else []
+                })
+            if not results:
+                break
+            offset += len(results)
+            logging.debug("DEV: Downloaded %d of %d platform games", offset, total)
+        return games
+
+
+    async def _call(self, request, priority):
+        ''' Returns the result of awaiting request() sent through the circuit breaker and the rate limiter
+
+        Raises BackendNotAvailable right away while the circuit breaker is open
+        '''
+        for attempt in range(self.retries + 1):
+            self.breaker.check()
+            try:
+                result = await self.rate_limiter.run(request, priority)
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except _BACKEND_FAILURES as error:
+                self.breaker.record_failure()
+                if not isinstance(error, _BACKOFF_ERRORS) or attempt == self.retries:
+                    raise
+                delay = backoff_delay(attempt)
+                metrics.increment("giant_bomb.retries")
+                logging.debug("DEV: Giant Bomb request failed with %r, retrying in %.1f seconds", error, delay)
+                await asyncio.sleep(delay)
+            except Exception:
+                # Giant Bomb answered, just not with something usable
+                self.breaker.record_success()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+
+    async def _games_page(self, api_key, offset) -> dict:
+        params = {
+            "api_key": api_key,
+            "field_list": "id,name,aliases",
+            "filter": "platforms:" + str(NES_PLATFORM_ID),
+            "format": "json",
+            "limit": str(GAMES_PAGE_SIZE),
+            "offset": str(offset),
+            "sort": "id:asc",
+        }
+        page = await self._get_json(GAMES_URL, params)
+        if not isinstance(page.get("results"), list):
+            raise UnknownBackendResponse("Games page has no results")
+        return page
+
+
+    async def _search(self, api_key, query) -> Optional[dict]:
+        params = {
+            "api_key": api_key,
+            "field_list": "id,name",
+            "format": "json",
+            "limit": "1",
+            "query": query,
+            "resources": "game",
+        }
+        search_results = await self._get_json(SEARCH_URL, params)
+        logging.debug("DEV: Search results from url request - %s", search_results)
+
+        results = search_results.get("results")
+        if not results:
+            return None
+        try:
+            return { "id": results[0]["id"], "name": results[0]["name"] }
+        except (KeyError, TypeError):
+            raise UnknownBackendResponse("Search result has no id or name")
+
+
+    async def _get_json(self, url, params) -> dict:
+        async def fetch():
+            response = await self._get_session().get(url, params=params)
+            try:
+                return await response.json(), response.headers
+            except ValueError:
+                raise UnknownBackendResponse("Response is not JSON")
+
+        async with self._get_semaphore():
+            with handle_exception(), handle_throttling():
+                data, headers = await asyncio.wait_for(fetch(), self.request_timeout)
+        return check_response(data, headers)
+
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+    def _get_session(self):
+        if self._session is None:
+            # The connector keeps its default limit, the semaphore bounds the requests so its size can change
+            self._session = create_client_session(
+                headers=self.HEADERS,
+                connector=create_tcp_connector()
+            )
+        return self._session
+
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Created on first use so it belongs to the running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_requests)
+        return self._semaphore
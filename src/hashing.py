@@ -0,0 +1,253 @@
+import asyncio
+import hashlib
+import json
+import logging
+import mmap
+import os
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
+
+from archives import open_rom, split_member
+
+BULK_HASH_THRESHOLD = 64
+CHUNK_SIZE = 1024 * 1024
+MMAP_THRESHOLD = 4 * CHUNK_SIZE
+HEADER_SIZE = 16
+HEADER_MAGICS = (b"NES\x1a", b"FDS\x1a")
+
+
+@dataclass(frozen=True)
+class RomHash():
+    """ RomHash object.
+
+    :param crc32: CRC32 of the rom payload as 8 lowercase hex digits
+    :param sha1: SHA-1 of the rom payload as 40 lowercase hex digits, None for roms identified by their archive crc32
+    """
+    crc32: str
+    sha1: Optional[str]
+
+    @property
+    def key(self) -> str:
+        ''' Returns the key identifying the rom content'''
+        return self.sha1 if self.sha1 is not None else "crc32:" + self.crc32
+
+
+def payload_offset(header) -> int:
+    ''' Returns the offset of the rom payload, skipping an iNES/NES 2.0 or fwNES FDS header'''
+    return HEADER_SIZE if header[:4] in HEADER_MAGICS else 0
+
+
+def hash_rom(path) -> RomHash:
+    ''' Returns the RomHash of a rom file
+
+    The iNES/FDS header is excluded so headered and headerless dumps of a cart hash the same,
+    large files are mapped instead of read
+    '''
+    sha1 = hashlib.sha1()
+    with open_rom(path) as (rom, size):
+        header = rom.read(HEADER_SIZE)
+        offset = payload_offset(header)
+        if size > MMAP_THRESHOLD and split_member(path)[1] is None:
+            with mmap.mmap(rom.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                payload = memoryview(mapped)[offset:]
+                crc = zlib.crc32(payload)
+                sha1.update(payload)
+                payload.release()
+        else:
+            crc = zlib.crc32(header[offset:])
+            sha1.update(header[offset:])
+            for chunk in iter(lambda: rom.read(CHUNK_SIZE), b""):
+                crc = zlib.crc32(chunk, crc)
+                sha1.update(chunk)
+
+    return RomHash("%08x" % crc, sha1.hexdigest())
+
+
+class HashCache:
+    ''' Persistent cache of rom hashes keyed by (path, size, mtime)
+
+    A rom is only hashed again when it is moved, resized or touched.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}  # rom path -> [size, mtime, crc32, sha1]
+        self.dirty = False
+        self._lock = threading.Lock()
+        self.load()
+
+
+    def load(self) -> None:
+        try:
+            with open(self.path, encoding="utf-8") as cache_file:
+                self.entries = json.load(cache_file)
+        except FileNotFoundError:
+            pass
+        except ValueError:
+            logging.exception("DEV: Hash cache is corrupt, roms will be hashed again")
+            self.entries = {}
+
+
+    def save(self) -> None:
+        ''' Returns None
+
+        Writes the cache if anything changed since it was loaded
+        '''
+        if not self.dirty:
+            return
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+
+        tmp_path = self.path + ".tmp"
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as cache_file:
+                json.dump(self.entries, cache_file)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+
+    def get(self, path, size, mtime, crc32=None) -> RomHash:
+        ''' Returns the cached RomHash of a rom, hashing it first if needed
+
+        A rom given the crc32 from its archive directory is identified by it and never hashed. That crc32 covers
+        the whole member, so it is only passed for roms without a header, headered ones are hashed like plain files.
+        '''
+        if crc32 is not None:
+            return RomHash(crc32, None)
+
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == size and entry[1] == mtime:
+            return RomHash(entry[2], entry[3])
+
+        rom_hash = hash_rom(path)
+        self.put(path, size, mtime, rom_hash)
+        return rom_hash
+
+
+    def put(self, path, size, mtime, rom_hash) -> None:
+        with self._lock:
+            self.entries[path] = [size, mtime, rom_hash.crc32, rom_hash.sha1]
+            self.dirty = True
+
+
+    def is_cached(self, path, size, mtime, crc32=None) -> bool:
+        if crc32 is not None:
+            return True
+        entry = self.entries.get(path)
+        return entry is not None and entry[0] == size and entry[1] == mtime
+
+
+    def prune(self, paths) -> None:
+        ''' Returns None
+
+        Drops the entries of roms that are no longer in the library
+        '''
+        with self._lock:
+            for path in paths:
+                if self.entries.pop(path, None) is not None:
+                    self.dirty = True
+
+
+def _shutdown_executor(executor) -> None:
+    # Roms already queued are dropped, cancel_futures only exists since Python 3.9
+    try:
+        executor.shutdown(wait=False, cancel_futures=True)
+    except TypeError:
+        executor.shutdown(wait=False)
+
+
+class BulkHasher:
+    ''' Hashes many roms at once on a process pool sized to the machine's cores
+
+    Used for the first import of a library so hashing neither holds the GIL nor occupies
+    the event loop's default executor. Falls back to a thread pool if processes cannot be started.
+    '''
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self._executor = None
+        self._cancelled = False
+
+
+    async def hash_all(self, roms, progress=None) -> AsyncIterator[tuple]:
+        ''' Returns an async iterator of (path, size, mtime, RomHash) in completion order
+
+        roms is a list of (path, size, mtime), progress is called with (done, total) after every rom.
+        Roms that fail to hash are logged and skipped.
+        '''
+        loop = asyncio.get_running_loop()
+        if self._cancelled:
+            raise asyncio.CancelledError()
+        self._executor = self._create_executor()
+        queue = list(reversed(roms))
+        pending = {}
+        done_count = 0
+        try:
+            while queue or pending:
+                # Keep the pool busy but only a few roms ahead, so cancelling leaves little queued work behind
+                while queue and len(pending) < self.workers * 2 and not self._cancelled:
+                    rom = queue.pop()
+                    pending[loop.run_in_executor(self._executor, hash_rom, rom[0])] = rom
+                if self._cancelled:
+                    raise asyncio.CancelledError()
+
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    path, size, mtime = pending.pop(future)
+                    try:
+                        rom_hash = future.result()
+                    except BrokenProcessPool:
+                        self._fall_back_to_threads()
+                        queue.append((path, size, mtime))
+                        continue
+                    except OSError:
+                        logging.exception("DEV: Failed to hash rom - %s", path)
+                        rom_hash = None
+
+                    done_count += 1
+                    if progress is not None:
+                        progress(done_count, len(roms))
+                    if rom_hash is not None:
+                        yield path, size, mtime, rom_hash
+        finally:
+            for future in pending:
+                future.cancel()
+            _shutdown_executor(self._executor)
+            self._executor = None
+
+
+    def reset(self) -> None:
+        ''' Returns None
+
+        Allows hashing again after cancel(), called when a new import starts
+        '''
+        self._cancelled = False
+
+
+    def cancel(self) -> None:
+        ''' Returns None
+
+        Stops handing out roms and drops the ones already queued, called on plugin shutdown.
+        hash_all raises CancelledError until reset() is called.
+        '''
+        self._cancelled = True
+        if self._executor is not None:
+            _shutdown_executor(self._executor)
+
+
+    def _fall_back_to_threads(self) -> None:
+        if isinstance(self._executor, ThreadPoolExecutor):
+            return
+        logging.warning("DEV: Hashing process pool broke, hashing on threads instead")
+        _shutdown_executor(self._executor)
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="rom-hasher")
+
+
+    def _create_executor(self):
+        try:
+            return ProcessPoolExecutor(self.workers)
+        except (OSError, NotImplementedError):
+            logging.exception("DEV: Failed to start hashing processes, hashing on threads instead")
+            return ThreadPoolExecutor(self.workers, thread_name_prefix="rom-hasher")
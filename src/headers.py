@@ -0,0 +1,330 @@
+import json
+import logging
+import os
+import struct
+import threading
+from array import array
+from dataclasses import dataclass, replace
+from typing import Optional
+
+from archives import open_rom
+from hashing import payload_offset
+
+HEADER_READ_SIZE = 128
+INDEX_VERSION = 3
+# Headerless dumps, as in No-Intro sets, have only their extension to tell them apart
+HEADERLESS_EXTENSIONS = (".nes", ".unf")
+
+KIND_INES = 1
+KIND_NES20 = 2
+KIND_FDS = 3
+KIND_NSF = 4
+KIND_NSFE = 5
+KIND_UNIF = 6
+# No header that is recognised, every other field is unknown
+KIND_HEADERLESS = 7
+KIND_NAMES = { KIND_INES: "iNES", KIND_NES20: "NES 2.0", KIND_FDS: "FDS", KIND_NSF: "NSF", KIND_NSFE: "NSFe", KIND_UNIF: "UNIF",
+    KIND_HEADERLESS: "Headerless" }
+
+REGION_UNKNOWN = -1
+REGION_NTSC = 0
+REGION_PAL = 1
+REGION_MULTI = 2
+REGION_DENDY = 3
+REGION_NAMES = { REGION_NTSC: "NTSC", REGION_PAL: "PAL", REGION_MULTI: "Multi-region", REGION_DENDY: "Dendy" }
+
+FLAG_BATTERY = 0x01
+FLAG_TRAINER = 0x02
+# The rom starts with an iNES/NES 2.0 or fwNES header that is not part of its payload
+FLAG_HEADER = 0x04
+
+FDS_SIDE_SIZE = 65500
+_FDS_DISK_MAGIC = b"\x01*NINTENDO-HVC*"
+
+
+@dataclass(frozen=True)
+class RomHeader():
+    """ RomHeader object.
+
+    :param kind: one of the KIND_ constants
+    :param mapper: iNES mapper number, -1 if the format has none
+    :param prg_kb: PRG ROM size in KiB, or the number of disk sides for FDS images
+    :param chr_kb: CHR ROM size in KiB
+    :param region: one of the REGION_ constants
+    :param flags: FLAG_ bits
+    :param songs: number of songs in NSF/NSFe rips
+    """
+    kind: int
+    mapper: int = -1
+    prg_kb: int = 0
+    chr_kb: int = 0
+    region: int = REGION_UNKNOWN
+    flags: int = 0
+    songs: int = 0
+
+
+def _rom_kb(lsb, msb_nibble, unit_kb) -> int:
+    if msb_nibble != 0x0F:
+        return ((msb_nibble << 8) | lsb) * unit_kb
+    # NES 2.0 exponent-multiplier notation, size = 2^E * (M*2+1) bytes
+    return (2 ** (lsb >> 2)) * ((lsb & 0x03) * 2 + 1) // 1024
+
+
+def _parse_ines(data, size) -> Optional[RomHeader]:
+    flags6, flags7 = data[6], data[7]
+    flags = (FLAG_BATTERY if flags6 & 0x02 else 0) | (FLAG_TRAINER if flags6 & 0x04 else 0)
+    mapper = (flags6 >> 4) | (flags7 & 0xF0)
+
+    if flags7 & 0x0C == 0x08:
+        kind = KIND_NES20
+        mapper |= (data[8] & 0x0F) << 8
+        prg_kb = _rom_kb(data[4], data[9] & 0x0F, 16)
+        chr_kb = _rom_kb(data[5], data[9] >> 4, 8)
+        region = data[12] & 0x03
+    else:
+        kind = KIND_INES
+        prg_kb = data[4] * 16
+        chr_kb = data[5] * 8
+        region = REGION_PAL if data[9] & 0x01 else REGION_NTSC
+
+    payload_size = 16 + (512 if flags & FLAG_TRAINER else 0) + (prg_kb + chr_kb) * 1024
+    if prg_kb == 0 or size < payload_size:
+        return None
+    return RomHeader(kind, mapper, prg_kb, chr_kb, region, flags)
+
+
+def _parse_fds(data, size) -> Optional[RomHeader]:
+    if data[:4] == b"FDS\x1a":
+        sides = data[4]
+        if sides == 0 or size < 16 + sides * FDS_SIDE_SIZE:
+            return None
+        return RomHeader(KIND_FDS, prg_kb=sides, region=REGION_NTSC)
+    if data[:15] == _FDS_DISK_MAGIC and size >= FDS_SIDE_SIZE:
+        return RomHeader(KIND_FDS, prg_kb=size // FDS_SIDE_SIZE, region=REGION_NTSC)
+    return None
+
+
+def _parse_nsf(data, size) -> Optional[RomHeader]:
+    if len(data) < 0x80 or size <= 0x80 or data[6] == 0:
+        return None
+    region_bits = data[0x7A] & 0x03
+    region = REGION_MULTI if region_bits & 0x02 else REGION_PAL if region_bits else REGION_NTSC
+    return RomHeader(KIND_NSF, region=region, songs=data[6])
+
+
+def _parse_nsfe(data, size) -> Optional[RomHeader]:
+    offset = 4
+    while offset + 8 <= len(data):
+        length, chunk_id = struct.unpack_from("<I4s", data, offset)
+        if chunk_id == b"INFO":
+            info = data[offset + 8:offset + 8 + length]
+            if len(info) < 9 or info[8] == 0:
+                return None
+            region_bits = info[6] & 0x03
+            region = REGION_MULTI if region_bits & 0x02 else REGION_PAL if region_bits else REGION_NTSC
+            return RomHeader(KIND_NSFE, region=region, songs=info[8])
+        offset += 8 + length
+    return None
+
+
+def _parse_unif(data, size) -> Optional[RomHeader]:
+    # Board, battery and sizes live in chunks further into the file, only the magic is checked here
+    if size <= 32:
+        return None
+    return RomHeader(KIND_UNIF)
+
+
+_PARSERS = {
+    b"NES\x1a": _parse_ines,
+    b"FDS\x1a": _parse_fds,
+    b"\x01*NI": _parse_fds,
+    b"NESM": _parse_nsf,
+    b"NSFE": _parse_nsfe,
+    b"UNIF": _parse_unif,
+}
+
+
+def parse_header(data, size) -> Optional[RomHeader]:
+    ''' Returns the RomHeader parsed from the first bytes of a rom, None if it is not a valid rom
+
+    size is the size of the whole file, used to reject truncated dumps. Only a recognised header whose
+    sizes do not match the file makes a rom invalid, data without one gives a KIND_HEADERLESS header.
+    '''
+    if size == 0:
+        return None
+    parser = _PARSERS.get(bytes(data[:4]))
+    if parser is None:
+        return RomHeader(KIND_HEADERLESS)
+    if len(data) < 16:
+        return None
+    try:
+        header = parser(data, size)
+    except (IndexError, struct.error):
+        return None
+    if header is not None and payload_offset(data) > 0:
+        header = replace(header, flags=header.flags | FLAG_HEADER)
+    return header
+
+
+def read_header(path) -> Optional[RomHeader]:
+    ''' Returns the RomHeader of a rom file, reading only its first bytes
+
+    Roms without a recognised header are only valid when their extension allows headerless dumps
+    '''
+    with open_rom(path) as (rom, size):
+        header = parse_header(rom.read(HEADER_READ_SIZE), size)
+    if header is not None and header.kind == KIND_HEADERLESS and not path.lower().endswith(HEADERLESS_EXTENSIONS):
+        return None
+    return header
+
+
+class HeaderIndex:
+    ''' Compact index of rom headers
+
+    Every field is stored in its own typed array indexed by row, the only per-rom objects are the paths.
+    Invalid roms keep a row with kind 0 so they are not read again until they change.
+    '''
+    COLUMNS = (("size", "q"), ("mtime", "d"), ("kind", "B"), ("mapper", "h"), ("prg_kb", "I"),
+        ("chr_kb", "I"), ("region", "b"), ("flags", "B"), ("songs", "H"))
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = {}  # rom path -> row
+        self.paths = []
+        self.columns = {name: array(typecode) for name, typecode in self.COLUMNS}
+        self.dirty = False
+        self._lock = threading.Lock()
+        self.load()
+
+
+    def load(self) -> None:
+        try:
+            with open(self.path, encoding="utf-8") as index_file:
+                data = json.load(index_file)
+            if data.get("version") != INDEX_VERSION:
+                raise ValueError("Unsupported header index version")
+            paths = data["paths"]
+            columns = {name: array(typecode, data["columns"][name]) for name, typecode in self.COLUMNS}
+            if any(len(column) != len(paths) for column in columns.values()):
+                raise ValueError("Header index columns have different lengths")
+        except FileNotFoundError:
+            return
+        except (ValueError, KeyError, TypeError, OverflowError):
+            logging.exception("DEV: Header index is corrupt, headers will be read again")
+            return
+        self.paths = paths
+        self.columns = columns
+        self.rows = {path: row for row, path in enumerate(paths)}
+
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+
+        tmp_path = self.path + ".tmp"
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as index_file:
+                json.dump({ "version": INDEX_VERSION, "paths": self.paths, "columns": {name: column.tolist() for name, column in self.columns.items()} }, index_file)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+
+    def update(self, path, size, mtime) -> None:
+        ''' Returns None
+
+        Reads the header of a rom unless it is already indexed with the same size and mtime
+        '''
+        with self._lock:
+            row = self.rows.get(path)
+            if row is not None and self.columns["size"][row] == size and self.columns["mtime"][row] == mtime:
+                return
+
+        try:
+            header = read_header(path)
+        except OSError:
+            logging.exception("DEV: Failed to read rom header - %s", path)
+            header = None
+        if header is None:
+            logging.debug("DEV: Not a valid rom - %s", path)
+            header = RomHeader(0)
+
+        values = (size, mtime, header.kind, header.mapper, header.prg_kb, header.chr_kb, header.region, header.flags, header.songs)
+        with self._lock:
+            # Looked up again, another thread may have indexed the rom or moved its row while the header was read
+            row = self.rows.get(path)
+            if row is None:
+                self.rows[path] = len(self.paths)
+                self.paths.append(path)
+                for (name, _), value in zip(self.COLUMNS, values):
+                    self.columns[name].append(value)
+            else:
+                for (name, _), value in zip(self.COLUMNS, values):
+                    self.columns[name][row] = value
+            self.dirty = True
+
+
+    def remove(self, paths) -> None:
+        ''' Returns None
+
+        Drops roms from the index by moving the last row into their place
+        '''
+        with self._lock:
+            for path in paths:
+                row = self.rows.pop(path, None)
+                if row is None:
+                    continue
+                last = len(self.paths) - 1
+                if row != last:
+                    self.paths[row] = self.paths[last]
+                    self.rows[self.paths[row]] = row
+                    for column in self.columns.values():
+                        column[row] = column[last]
+                self.paths.pop()
+                for column in self.columns.values():
+                    column.pop()
+                self.dirty = True
+
+
+    def has_header(self, path) -> bool:
+        ''' Returns True if the rom is indexed and starts with a header that is not part of its payload'''
+        row = self.rows.get(path)
+        return row is not None and bool(self.columns["flags"][row] & FLAG_HEADER)
+
+
+    def is_valid(self, path) -> bool:
+        ''' Returns True if the rom is indexed and has a valid header'''
+        row = self.rows.get(path)
+        return row is not None and self.columns["kind"][row] != 0
+
+
+    def get(self, path) -> Optional[RomHeader]:
+        row = self.rows.get(path)
+        if row is None or self.columns["kind"][row] == 0:
+            return None
+        columns = self.columns
+        return RomHeader(columns["kind"][row], columns["mapper"][row], columns["prg_kb"][row], columns["chr_kb"][row],
+            columns["region"][row], columns["flags"][row], columns["songs"][row])
+
+
+    def filter(self, **criteria) -> list:
+        ''' Returns the paths of the valid roms whose columns equal all given values, e.g. filter(mapper=4, region=REGION_PAL)'''
+        kinds = self.columns["kind"]
+        selected = [(self.columns[name], value) for name, value in criteria.items()]
+        return [path for row, path in enumerate(self.paths)
+            if kinds[row] != 0 and all(column[row] == value for column, value in selected)]
+
+
+def header_tags(header) -> list:
+    ''' Returns the Galaxy library tags describing a RomHeader'''
+    tags = [KIND_NAMES[header.kind]]
+    if header.region in REGION_NAMES:
+        tags.append(REGION_NAMES[header.region])
+    if header.mapper >= 0:
+        tags.append("Mapper {}".format(header.mapper))
+    if header.flags & FLAG_BATTERY:
+        tags.append("Battery save")
+    if header.songs:
+        tags.append("{} songs".format(header.songs))
+    return tags
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import threading
+from dataclasses import dataclass, field
+
+from archives import ARCHIVE_SEPARATOR
+from scanner import DirectoryScanner
+
+INDEX_VERSION = 2
+
+
+@dataclass
+class LibraryChanges():
+    """ Result of a library rescan.
+
+    :param added: paths of roms that were not in the index before
+    :param removed: paths of roms that are no longer on disk
+    :param modified: paths of roms whose size or mtime changed
+    """
+    added: list = field(default_factory=list)
+    removed: list = field(default_factory=list)
+    modified: list = field(default_factory=list)
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.modified)
+
+
+def rom_name(path) -> str:
+    ''' Returns the name of a rom, its file name without the extension'''
+    return os.path.splitext(os.path.basename(path.rpartition(ARCHIVE_SEPARATOR)[2]))[0]
+
+
+class LibraryIndex:
+    ''' Persistent index of the roms folder
+
+    Stores the mtime of every directory and the (size, mtime, crc32) of every rom so a rescan
+    only has to list the directories that changed since the last one.
+    '''
+    def __init__(self, path, scanner=None):
+        self.path = path
+        self.scanner = scanner or DirectoryScanner()
+        self.root = None
+        self.dirs = {}  # dir path -> [mtime, [subdir names], [rom names]]
+        self.roms = {}  # rom path -> [size, mtime, crc32 from the archive directory or None]
+        self._lock = threading.Lock()
+        self.load()
+
+
+    def load(self) -> None:
+        ''' Returns None
+
+        Reads the index from disk, a missing or unreadable index is treated as empty
+        '''
+        try:
+            with open(self.path, encoding="utf-8") as index_file:
+                data = json.load(index_file)
+            if data.get("version") != INDEX_VERSION:
+                raise ValueError("Unsupported library index version")
+            self.root = data["root"]
+            self.dirs = data["dirs"]
+            self.roms = data["roms"]
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError):
+            logging.exception("DEV: Library index is corrupt, it will be rebuilt")
+            self.root = None
+            self.dirs = {}
+            self.roms = {}
+
+
+    def save(self) -> None:
+        ''' Returns None
+
+        Writes the index next to its final location and swaps it in, so a crash never leaves half an index
+        '''
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+
+        tmp_path = self.path + ".tmp"
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as index_file:
+                json.dump({ "version": INDEX_VERSION, "root": self.root, "dirs": self.dirs, "roms": self.roms }, index_file)
+            os.replace(tmp_path, self.path)
+
+
+    def rescan(self, root, full=False, dirty=()) -> LibraryChanges:
+        ''' Returns the LibraryChanges since the previous scan
+
+        Directories whose mtime did not change are not listed again, only their known subdirectories are visited.
+        A rom rewritten in place does not touch its directory's mtime, pass its directory in dirty
+        or full=True to list every directory.
+        '''
+        with self._lock:
+            return self._rescan(root, full, dirty)
+
+
+    def _rescan(self, root, full, dirty) -> LibraryChanges:
+        changes = LibraryChanges()
+        if root != self.root:
+            changes.removed.extend(self.roms)
+            self.root = root
+            self.dirs = {}
+            self.roms = {}
+
+        old_dirs = self.dirs
+        new_dirs = {}
+        for listing in self.scanner.scan(root, old_dirs, full, dirty):
+            if listing.roms is None:
+                new_dirs[listing.path] = old_dirs[listing.path]
+            else:
+                new_dirs[listing.path] = self._apply_listing(listing, old_dirs.get(listing.path), changes)
+
+        # Everything below a directory that disappeared is gone as well
+        for path in old_dirs.keys() - new_dirs.keys():
+            for name in old_dirs[path][2]:
+                rom_path = os.path.join(path, name)
+                if self.roms.pop(rom_path, None) is not None:
+                    changes.removed.append(rom_path)
+
+        self.dirs = new_dirs
+        if changes:
+            logging.debug("DEV: Library changes - %d added, %d removed, %d modified",
+                len(changes.added), len(changes.removed), len(changes.modified))
+        return changes
+
+
+    def _apply_listing(self, listing, known, changes) -> list:
+        ''' Returns the index entry of a listed directory
+
+        Records added, removed and modified roms of the directory in changes
+        '''
+        names = []
+        for name, size, mtime, crc32 in listing.roms:
+            rom_path = os.path.join(listing.path, name)
+            names.append(name)
+            old = self.roms.get(rom_path)
+            new = [size, mtime, crc32]
+            if old is None:
+                changes.added.append(rom_path)
+            elif old != new:
+                changes.modified.append(rom_path)
+            self.roms[rom_path] = new
+
+        if known is not None:
+            for name in set(known[2]).difference(names):
+                rom_path = os.path.join(listing.path, name)
+                if self.roms.pop(rom_path, None) is not None:
+                    changes.removed.append(rom_path)
+
+        return [listing.mtime, listing.subdirs, names]
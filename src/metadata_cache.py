@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+DEFAULT_TTL = 30 * 24 * 60 * 60
+DEFAULT_NEGATIVE_TTL = 24 * 60 * 60
+
+
+@dataclass
+class CacheEntry():
+    """ CacheEntry object.
+
+    :param value: cached lookup result, None for a lookup that found nothing
+    :param stale: True if the entry outlived its time to live and should be revalidated
+    """
+    value: Optional[dict]
+    stale: bool
+
+
+class MetadataCache:
+    ''' SQLite store of metadata lookups keyed by rom content hash
+
+    Every entry has its own expiry time, lookups that found nothing are cached for a shorter time.
+    Expired entries are still returned, flagged as stale, so callers can serve them while they revalidate.
+    '''
+    def __init__(self, path, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._connection = None
+        self._lock = threading.Lock()
+
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            if self.path != ":memory:" and not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT, expires_at REAL NOT NULL)"
+            )
+        return self._connection
+
+
+    def get(self, key) -> Optional[CacheEntry]:
+        ''' Returns the CacheEntry of a key, None if it was never cached'''
+        with self._lock:
+            row = self._connect().execute("SELECT value, expires_at FROM metadata WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        return CacheEntry(json.loads(value) if value is not None else None, expires_at <= self.clock())
+
+
+    def put(self, key, value) -> None:
+        ''' Returns None
+
+        Caches a lookup result, value None records that nothing was found. Changes are written on commit.
+        '''
+        ttl = self.ttl if value is not None else self.negative_ttl
+        with self._lock:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO metadata (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value) if value is not None else None, self.clock() + ttl)
+            )
+
+
+    def commit(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                self._connection.commit()
+
+
+    def close(self) -> None:
+        with self._lock:
+            if self._connection is not None:
+                try:
+                    self._connection.commit()
+                    self._connection.close()
+                except sqlite3.Error:
+                    logging.exception("DEV: Failed to close metadata cache")
+                self._connection = None
@@ -0,0 +1,29 @@
+from collections import Counter
+
+
+class Metrics:
+    ''' Counters and gauges describing what the plugin is doing
+
+    The plugin logs a snapshot of them periodically.
+    '''
+    def __init__(self):
+        self.counters = Counter()
+        self.gauges = {}
+
+
+    def increment(self, name, count=1) -> None:
+        self.counters[name] += count
+
+
+    def set(self, name, value) -> None:
+        self.gauges[name] = value
+
+
+    def snapshot(self) -> dict:
+        ''' Returns a dict of every counter and gauge by name'''
+        snapshot = dict(self.counters)
+        snapshot.update(self.gauges)
+        return snapshot
+
+
+metrics = Metrics()
@@ -0,0 +1,112 @@
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+# GoodNES style region codes, several can be combined as in (UE) or (JU)
+REGION_CODES = {
+    "U": "USA", "E": "Europe", "J": "Japan", "W": "World", "F": "France", "G": "Germany", "S": "Spain",
+    "I": "Italy", "K": "Korea", "A": "Australia", "B": "Brazil", "C": "China", "Ch": "China",
+    "Sw": "Sweden", "Nl": "Netherlands", "Unk": "Unknown",
+}
+# No-Intro style region names as in (USA, Europe)
+REGION_NAMES = {
+    "usa", "europe", "japan", "world", "france", "germany", "spain", "italy", "korea", "australia", "brazil",
+    "china", "sweden", "netherlands", "asia", "canada", "taiwan", "hong kong", "russia", "scandinavia", "unknown",
+}
+LANGUAGES = { "En", "Fr", "De", "Es", "It", "Ja", "Nl", "Sv", "Pt", "Zh", "Ko", "Da", "No", "Fi", "Pl", "Ru" }
+
+_TAG = re.compile(r"\(([^)]*)\)|\[([^\]]*)\]")
+_REGION_CODE = re.compile(r"^(?:Ch|Sw|Nl|Unk|[UEJWFGSIKABC])+$")
+_REGION_CODE_PART = re.compile(r"Ch|Sw|Nl|Unk|[UEJWFGSIKABC]")
+_REVISION = re.compile(r"^(?:Rev ?([A-Z0-9.]+)|PRG ?(\d+)|[Vv] ?(\d+(?:\.\d+)*))$")
+_LANGUAGE_SPLIT = re.compile(r"[,+]")
+_HACK = re.compile(r"^(?:h\d*[A-Za-z0-9 ]*|.*\bHack\b.*)$")
+_TRANSLATION = re.compile(r"^T[+-]")
+_DUMP_FLAGS = (
+    (re.compile(r"^!$"), "verified"),
+    (re.compile(r"^b\d*"), "bad dump"),
+    (re.compile(r"^a\d*$"), "alternate"),
+    (re.compile(r"^o\d*$"), "overdump"),
+    (re.compile(r"^f\d*"), "fixed"),
+    (re.compile(r"^p\d*$"), "pirate"),
+    (re.compile(r"^t\d*$"), "trainer"),
+)
+_ARTICLE = re.compile(r"^(.*?),\s+(The|A|An)\b(.*)$", re.IGNORECASE)
+_NON_WORD = re.compile(r"[^\w]+")
+
+
+@dataclass(frozen=True)
+class RomName():
+    """ RomName object.
+
+    :param title: title of the game without tags, with a trailing article moved to the front
+    :param key: canonical lowercase key of the title, the same for every release of a game
+    :param regions: region names found in the tags
+    :param languages: language codes found in the tags
+    :param revision: revision, PRG or version number, None if there is none
+    :param hack: True for hacks
+    :param translation: True for fan translations
+    :param flags: other dump flags such as "verified" or "bad dump"
+    :param tags: tags that matched no rule
+    """
+    title: str
+    key: str
+    regions: tuple = ()
+    languages: tuple = ()
+    revision: Optional[str] = None
+    hack: bool = False
+    translation: bool = False
+    flags: tuple = ()
+    tags: tuple = ()
+
+
+def title_key(title) -> str:
+    ''' Returns the canonical key of a title, lowercase words separated by single spaces'''
+    return _NON_WORD.sub(" ", title.replace("'", "").replace("&", " and ").lower()).strip()
+
+
+def parse_rom_name(name) -> RomName:
+    ''' Returns the RomName parsed from a GoodNES or No-Intro style rom name without extension'''
+    first_tag = _TAG.search(name)
+    title = (name[:first_tag.start()] if first_tag else name).strip() or name.strip()
+    article = _ARTICLE.match(title)
+    if article:
+        title = "{} {}{}".format(article.group(2), article.group(1), article.group(3))
+
+    regions = []
+    languages = []
+    revision = None
+    hack = False
+    translation = False
+    flags = []
+    tags = []
+    for paren, bracket in _TAG.findall(name):
+        if bracket:
+            if _TRANSLATION.match(bracket):
+                translation = True
+            elif _HACK.match(bracket):
+                hack = True
+            else:
+                flag = next((flag for pattern, flag in _DUMP_FLAGS if pattern.match(bracket)), None)
+                if flag is not None:
+                    flags.append(flag)
+                else:
+                    tags.append(bracket)
+            continue
+
+        parts = [part.strip() for part in paren.split(",")]
+        if all(part.lower() in REGION_NAMES for part in parts):
+            regions.extend(parts)
+        elif _REGION_CODE.match(paren):
+            regions.extend(REGION_CODES[code] for code in _REGION_CODE_PART.findall(paren))
+        elif all(part in LANGUAGES for part in _LANGUAGE_SPLIT.split(paren)):
+            languages.extend(_LANGUAGE_SPLIT.split(paren))
+        elif _REVISION.match(paren):
+            revision = next(group for group in _REVISION.match(paren).groups() if group is not None)
+        elif _HACK.match(paren):
+            hack = True
+        else:
+            tags.append(paren)
+
+    return RomName(title, title_key(title), tuple(regions), tuple(languages), revision, hack, translation,
+        tuple(flags), tuple(tags))
@@ -1,19 +1,30 @@
 import asyncio
-import json
 import logging
 import os
-import subprocess
 import sys
-import time
+from typing import Optional
 
 import config
+from archives import ExtractCache
 from backend import AuthenticationServer
+from discovery import PathIndex, ProcessDiscovery
+from emulator import EmulatorProcess, LaunchError, launch
 from galaxy.api.consts import LicenseType, LocalGameState, Platform
 from galaxy.api.plugin import Plugin, create_and_run_plugin
-from galaxy.api.types import (Authentication, Game, GameTime, LicenseInfo,
-                              LocalGame, NextStep)
+from galaxy.api.types import (Authentication, Game, GameLibrarySettings,
+                              GameTime, LicenseInfo, LocalGame, NextStep)
+from gametimes import GameTimeStore
+from hashing import BULK_HASH_THRESHOLD
+from headers import header_tags
+from metrics import metrics
 from NESClient import NESClient
+from sessions import SessionTracker, is_emulator_running
 from version import __version__
+from watcher import RomWatcher
+
+
+# Seconds between checks of an emulator that was started before the plugin
+RESUMED_POLL_INTERVAL = 1
 
 
 class NintendoEntertainmentSystemPlugin(Plugin):
@@ -25,14 +36,28 @@ class NintendoEntertainmentSystemPlugin(Plugin):
         self.auth_server = AuthenticationServer()
         self.auth_server.start()
         self.games = []
-        self.local_games_cache = None
-        self.proc = None
         self.nes_client = NESClient(self)
-        self.running_game_id = ""
+        self.extract_cache = ExtractCache(os.path.expandvars(config.EXTRACT_CACHE_LOC), 0)
+        self.game_times = GameTimeStore(
+            os.path.expandvars(config.GAME_TIMES_LOC),
+            os.path.expandvars(config.GAME_TIMES_JOURNAL_LOC)
+        )
+        self.sessions = SessionTracker(self.game_times)
+        self.running = {}  # game id -> RunningGame
+        self.external = {}  # pid -> RunningGame of emulators started outside of Galaxy
+        self.launching = {}  # game id -> pid of emulators started by launch_game that have no session yet
+        self.discovery = ProcessDiscovery()
+        self.path_index = None
         self.tick_count = 0
+        self.full_game_time_sync = True
+        self.loop = asyncio.get_event_loop()
+        self._recover_sessions()
 
         ### Tasks ###
-        self.update_local_games_task = self.create_task(asyncio.sleep(0), "Update local games")
+        self.import_task = None
+        self.watch_roms_task = None
+
+        self.config.subscribe(self._config_changed)
 
         
     async def authenticate(self, stored_credentials=None):
@@ -55,38 +80,66 @@ class NintendoEntertainmentSystemPlugin(Plugin):
 
     def _do_auth(self) -> Authentication:
         user_data = {}
-        self.config.cfg.read(os.path.expandvars(config.CONFIG_LOC))
-        user_data["username"] = self.config.cfg.get("Paths", "roms_path")
+        user_data["username"] = self.config.snapshot().roms_path
         self.store_credentials(user_data)
         return Authentication("mesen_user", user_data["username"])
 
 
     async def launch_game(self, game_id):
-        self.running_game_id = game_id
-        logging.debug("DEV: Running game id is - %s", self.running_game_id)
-        self.config.cfg.read(os.path.expandvars(config.CONFIG_LOC))
-        emu_path = self.config.cfg.get("Paths", "emu_path")
-        fullscreen = self.config.cfg.getboolean("EmuSettings", "emu_fullscreen")
+        settings = self.config.snapshot()
+        self.extract_cache.max_bytes = settings.extract_cache_mb * 1024 * 1024
 
-        self._launch_game(game_id, emu_path, fullscreen)
+        emulator = await self._launch_game(game_id, settings.emu_path, settings.emu_fullscreen, settings.launch_timeout)
         logging.debug("DEV: Launch game has been called")
-        self.nes_client._set_session_start()
-
-
-    def _launch_game(self, game_id, emu_path, fullscreen) -> None:
-        ''' Returns None
-
-        Interprets user configurated options and launches Mesen with the chosen rom
+        if emulator is None:
+            if game_id not in self.running:
+                # Galaxy is told the game is not running so it does not wait for it
+                self.update_local_game_status(LocalGame(game_id, LocalGameState.Installed))
+            return
+
+        logging.debug("DEV: Running game id is - %s", game_id)
+        if game_id in self.running:
+            # The session of the emulator already running the game is closed when it exits
+            logging.debug("DEV: Game was launched again while running - %s", game_id)
+        running_game = self.sessions.start(game_id, emulator.pid, emulator)
+        self.running[game_id] = running_game
+        self.update_local_game_status(LocalGame(game_id, LocalGameState.Installed | LocalGameState.Running))
+        self.create_task(self._supervise_emulator(running_game), "Supervise emulator")
+
+
+    async def _launch_game(self, game_id, emu_path, fullscreen, timeout) -> Optional[EmulatorProcess]:
+        ''' Returns the started emulator, None if the game is unknown or the emulator failed to start
+
+        Interprets user configurated options and launches Mesen with the chosen rom,
+        roms stored in a zip file are extracted first
         '''
         for game in self.games:
             if game.id == game_id:
                 args = [emu_path]
                 if fullscreen:
                     args.append("/fullscreen")
-                args.append(game.path)
-                self.proc = subprocess.Popen(args)
+                # The watcher drops a deleted rom from the library before its game is removed
+                rom = self.nes_client.library.roms.get(game.path)
+                if rom is None:
+                    logging.warning("DEV: Rom of the game is gone - %s", game.path)
+                    return None
+                crc32 = rom[2]
+
+                def started(pid):
+                    # Not taken for an external launch while launch waits to see if the emulator keeps running
+                    self.launching[game_id] = pid
+
+                try:
+                    args.append(self.extract_cache.extract(game.path, crc32))
+                    emulator = await launch(args, timeout, started)
+                except (LaunchError, OSError):
+                    logging.exception("DEV: Failed to launch game - %s", game_id)
+                    return None
+                finally:
+                    self.launching.pop(game_id, None)
                 logging.debug("DEV: Game has been launched with args - %s", args)
-                break
+                return emulator
+        return None
 
 
     # Only as placeholders so the launch game feature is recognized
@@ -108,15 +161,41 @@ class NintendoEntertainmentSystemPlugin(Plugin):
 
     def _get_local_size_dict(self) -> dict:
         ''' Returns a dict of game sizes
+
+        Sizes come from the library index, roms stored in a zip file report the size of the zip file.
+        Games whose rom was just deleted are left out.
         '''
         local_sizes = {}
         for game in self.games:
-            local_size = os.path.getsize(game.path)
-            local_sizes[game.id] = local_size
+            rom = self.nes_client.library.roms.get(game.path)
+            if rom is not None:
+                local_sizes[game.id] = rom[0]
 
         return local_sizes
 
 
+    async def prepare_game_library_settings_context(self, game_ids):
+        return self._get_library_settings_dict()
+
+
+    async def get_game_library_settings(self, game_id, context):
+        return context.get(game_id)
+
+
+    def _get_library_settings_dict(self) -> dict:
+        ''' Returns a dict of GameLibrarySettings objects
+
+        Tags every game with the format, region, mapper and battery flag from the header index
+        '''
+        library_settings = {}
+        for game in self.games:
+            header = self.nes_client.headers.get(game.path)
+            tags = header_tags(header) if header is not None else None
+            library_settings[game.id] = GameLibrarySettings(game.id, tags, None)
+
+        return library_settings
+
+
     async def prepare_game_times_context(self, game_ids):
         return self._get_games_times_dict()
 
@@ -128,43 +207,22 @@ class NintendoEntertainmentSystemPlugin(Plugin):
 
     def _get_games_times_dict(self) -> dict:
         ''' Returns a dict of GameTime objects
-        
-        Creates and reads the game_times.json file
+
+        Read from the in-memory game time store, games that were never played are added to it
         '''
         game_times = {}
-        path = os.path.expandvars(r"%LOCALAPPDATA%\GOG.com\Galaxy\Configuration\plugins\nes\game_times.json")
-        update_file = False
+        for game in self.games:
+            game_times[game.id] = self._get_game_time(game)
+        # Galaxy is about to receive all of them, the next sync does not have to send them again
+        self.game_times.mark_sent(game_times)
 
-        # Read the games times json
-        try:
-            with open(path, encoding="utf-8") as game_times_file:
-                data = json.load(game_times_file)
-        except FileNotFoundError:
-            data = {}
+        return game_times
 
-            if not os.path.isdir(os.path.dirname(path)):
-                os.makedirs(os.path.dirname(path))
-                
-            with open(path, "w", encoding="utf-8") as game_times_file:
-                json.dump(data, game_times_file, indent=4)
 
-        for game in self.games:
-            if game.id in data:
-                time_played = data.get(game.id).get("time_played")
-                last_time_played = data.get(game.id).get("last_time_played")
-            else:
-                time_played = 0
-                last_time_played = None
-                data[game.id] = { "name": game.name, "time_played": 0, "last_time_played": None }
-                update_file = True
-            
-            game_times[game.id] = GameTime(game.id, time_played, last_time_played)
-
-        if update_file == True:
-            with open(path, "w", encoding="utf-8") as game_times_file:
-                json.dump(data, game_times_file, indent=4)
-        
-        return game_times
+    def _get_game_time(self, game) -> GameTime:
+        self.game_times.add(game.id, game.name)
+        entry = self.game_times.get(game.id)
+        return GameTime(game.id, entry["time_played"], entry["last_time_played"])
 
 
     def _local_games_list(self) -> list:
@@ -175,7 +233,7 @@ class NintendoEntertainmentSystemPlugin(Plugin):
         local_games = []        
         for game in self.games:
             state = LocalGameState.Installed
-            if self.running_game_id == game.id:
+            if game.id in self.running:
                 state |= LocalGameState.Running
 
             local_games.append(
@@ -187,88 +245,247 @@ class NintendoEntertainmentSystemPlugin(Plugin):
         return local_games
 
 
+    def handshake_complete(self):
+        for running_game in self.running.values():
+            self.create_task(self._watch_resumed_session(running_game), "Watch resumed session")
+        self.create_task(self._discover_sessions(), "Discover sessions")
+
+
     def tick(self):
-        self._check_emu_status()
+        checkpointed = False
+        for running_game in self.running.values():
+            if self.sessions.checkpoint(running_game.session_id) is not None:
+                checkpointed = True
+        if checkpointed:
+            # Galaxy shows the play time of the running sessions as it grows
+            self._sync_game_times()
 
-        if self.local_games_cache is not None and self.update_local_games_task.done():
-            self.update_local_games_task = self.create_task(self._update_local_games(), "Update local games")
-        
         self.tick_count += 1
-        if self.tick_count % 12 == 0:
-            self.create_task(self._update_all_game_times(), "Update all game times")
+        if self.tick_count % 5 == 0:
+            # Picks up changes to config.ini even when nothing else reads it
+            self.config.snapshot()
+        if self.tick_count % 12 == 0 and self.games:
+            self._sync_game_times(self.full_game_time_sync)
+            self.full_game_time_sync = False
+        if self.tick_count % 60 == 0:
+            logging.debug("DEV: Metrics - %s", metrics.snapshot())
 
 
-    def _check_emu_status(self) -> None:
-        try:
-            if self.proc.poll() is not None:
-                logging.debug("DEV: Emulator process has been closed")
-                self.nes_client._set_session_end()
-                session_duration = self.nes_client._get_session_duration()
-                last_time_played = int(time.time())
-                self._update_game_time(self.running_game_id, session_duration, last_time_played)
-                self.proc = None
-                self.running_game_id = ""
-        except AttributeError:
-            pass
-
-
-    async def _update_local_games(self) -> None:
-        loop = asyncio.get_running_loop()
-        new_list = await loop.run_in_executor(None, self._local_games_list)
-        notify_list = self.nes_client._get_state_changes(self.local_games_cache, new_list)
-        self.local_games_cache = new_list
-        logging.debug("DEV: Local games cache is - %s", self.local_games_cache)
-        for game in notify_list:
-            self.update_local_game_status(game)
-        await asyncio.sleep(5)
+    async def _supervise_emulator(self, running_game) -> None:
+        ''' Returns None
+
+        Ends the session as soon as the emulator exits, an exit with an error is logged with the end of its stderr
+        '''
+        emulator = running_game.emulator
+        returncode = await emulator.wait()
+        if returncode != 0:
+            metrics.increment("emulator.failed")
+            logging.warning("DEV: Emulator exited with code %d - %s", returncode, emulator.stderr_tail())
+        self._end_session(running_game)
 
 
-    async def _update_all_game_times(self) -> None:
+    async def _watch_resumed_session(self, running_game) -> None:
+        ''' Returns None
+
+        A session resumed after a restart has no process handle to wait on, so its emulator is polled instead
+        '''
+        while is_emulator_running(running_game.pid, self.config.snapshot().emu_path):
+            await asyncio.sleep(RESUMED_POLL_INTERVAL)
+        self._end_session(running_game)
+
+
+    async def _discover_sessions(self) -> None:
+        ''' Returns None
+
+        Tracks the sessions of emulators started outside of Galaxy, from Mesen's recent games or another frontend
+        '''
         loop = asyncio.get_running_loop()
-        new_game_times = await loop.run_in_executor(None, self._get_games_times_dict)
-        for game_time in new_game_times:
-            self.update_game_time(new_game_times[game_time])
+        while True:
+            settings = self.config.snapshot()
+            await asyncio.sleep(settings.discovery_interval)
+            if not settings.detect_external_launches or not self.games:
+                continue
+            if self.path_index is None:
+                self.path_index = PathIndex(self.games, self.nes_client.library.roms, self.extract_cache.path)
+
+            ignored = {running_game.pid for running_game in self.running.values()}
+            ignored.update(self.launching.values())
+            started, stopped = await loop.run_in_executor(
+                None, self.discovery.scan, settings.emu_path, self.path_index, ignored
+            )
+            for pid in stopped:
+                running_game = self.external.pop(pid, None)
+                if running_game is not None:
+                    self._end_session(running_game)
+            for pid, game_id in started.items():
+                if game_id in self.running:
+                    continue
+                running_game = self.sessions.start(game_id, pid)
+                self.running[game_id] = running_game
+                self.external[pid] = running_game
+                self.update_local_game_status(LocalGame(game_id, LocalGameState.Installed | LocalGameState.Running))
+
+
+    def _end_session(self, running_game) -> None:
+        logging.debug("DEV: Emulator of game has been closed - %s", running_game.game_id)
+        self.sessions.finish(running_game.session_id)
+        self._sync_game_times()
+        if self.running.get(running_game.game_id) is not running_game:
+            # The game was launched again while this emulator was running, the newer session is still open
+            return
+        del self.running[running_game.game_id]
+        self.update_local_game_status(LocalGame(running_game.game_id, LocalGameState.Installed))
+
+
+    def _recover_sessions(self) -> None:
+        ''' Returns None
 
+        Resumes the sessions left open by a previous run whose emulator is still running,
+        the sessions of emulators that were closed in the meantime are closed
+        '''
+        emu_path = self.config.snapshot().emu_path
+        for running_game in self.sessions.recover(lambda pid: is_emulator_running(pid, emu_path)):
+            if running_game.game_id in self.running:
+                # Only one session per game is shown as running, close the others at their last checkpoint
+                self.sessions.finish(running_game.session_id)
+                continue
+            self.running[running_game.game_id] = running_game
+
+
+    async def _watch_roms(self) -> None:
+        watcher = RomWatcher(
+            self.nes_client._rescan,
+            lambda: list(self.nes_client.library.dirs),
+            lambda changes: self.create_task(self._update_library(changes), "Update library"),
+            self.config.snapshot().watch_interval
+        )
+        await watcher.run()
+
+
+    def _config_changed(self, old, new) -> None:
+        ''' Returns None
 
-    def _update_game_time(self, game_id, session_duration, last_time_played) -> None:
-        ''' Returns None 
-        
-        Update the game time of a single game
+        Imports the roms folder again when it was changed in config.ini, may be called from any thread
         '''
-        path = os.path.expandvars(r"%LOCALAPPDATA%\GOG.com\Galaxy\Configuration\plugins\nes\game_times.json")
+        if old.roms_path != new.roms_path:
+            logging.debug("DEV: Roms folder has changed to - %s", new.roms_path)
+            self.loop.call_soon_threadsafe(self._restart_import)
+
+
+    def _restart_import(self) -> None:
+        if self.import_task is None:
+            # Nothing was imported yet, get_owned_games will pick up the new folder
+            return
+        if not self.import_task.done():
+            self.import_task.cancel()
+        self.import_task = self.create_task(self._import_games(), "Import games")
+
+
+    async def _update_library(self, changes) -> None:
+        if len(changes.added) + len(changes.modified) >= BULK_HASH_THRESHOLD:
+            # As after a change of the roms folder, the import pipeline hashes and looks them up in bulk
+            for game in self.nes_client._apply_removals(changes):
+                self._notify_removed(game)
+            self._restart_import()
+            return
+        added, removed = await self.nes_client._get_changed_games(changes)
+        for game in removed:
+            self._notify_removed(game)
+        for game in added:
+            self._notify_added(game)
+
+
+    async def _import_games(self) -> None:
+        ''' Returns None
+
+        Streams the games that were not known yet to Galaxy as they are imported.
+        The roms folder is watched as soon as it has been scanned, lookups may take hours at the request limit.
+        '''
+        try:
+            await self.nes_client._stream_games(self._notify_added, self._notify_removed, self._start_watching)
+        finally:
+            self._start_watching()
 
-        with open(path, encoding="utf-8") as game_times_file:
-            data = json.load(game_times_file)
 
-        data[game_id]["time_played"] = data.get(game_id).get("time_played") + session_duration
-        data[game_id]["last_time_played"] = last_time_played
+    def _start_watching(self) -> None:
+        if self.watch_roms_task is None:
+            self.watch_roms_task = self.create_task(self._watch_roms(), "Watch roms folder")
 
-        with open(path, "w", encoding="utf-8") as game_times_file:
-            json.dump(data, game_times_file, indent=4)
 
-        self.update_game_time(GameTime(game_id, data.get(game_id).get("time_played"), last_time_played))
+    def _notify_added(self, game) -> None:
+        logging.debug("DEV: Rom has been added - %s", game.path)
+        self.games = self.nes_client.games
+        self.path_index = None
+        self.add_game(self._to_galaxy_game(game))
+        self.update_local_game_status(LocalGame(game.id, LocalGameState.Installed))
+
+
+    def _notify_removed(self, game) -> None:
+        logging.debug("DEV: Rom has been removed - %s", game.path)
+        self.games = self.nes_client.games
+        self.path_index = None
+        self.update_local_game_status(LocalGame(game.id, LocalGameState.None_))
+        self.remove_game(game.id)
+
+
+    def _sync_game_times(self, full=False) -> None:
+        ''' Returns None
+
+        Sends the game times that changed since the last sync, or of every game when full is set.
+        A full sync is done once after startup, set full_game_time_sync to request another one.
+        '''
+        if not self.games:
+            # Changes are kept until the games are known
+            return
+        for game in self.games:
+            self.game_times.add(game.id, game.name)
+        changed = self.game_times.take_changed()
+        games = {game.id: game for game in self.games}
+        sent = 0
+        for game in games.values():
+            if full or game.id in changed:
+                self.update_game_time(self._get_game_time(game))
+                sent += 1
+        metrics.increment("game_times.sent", sent)
+        metrics.increment("game_times.suppressed", len(games) - sent)
+
+
+    def _to_galaxy_game(self, game) -> Game:
+        return Game(
+            game.id,
+            game.name,
+            None,
+            LicenseInfo(LicenseType.SinglePurchase, None)
+        )
 
 
     async def get_owned_games(self):
-        owned_games = []
-        self.games = self.nes_client._get_games_giant_bomb()
-        
+        self.games = await self.nes_client._get_games_giant_bomb()
+        self.path_index = None
+        # Dumps of the same game share its id, Galaxy gets it once
+        unique_games = {}
         for game in self.games:
-            owned_games.append(
-                Game(
-                    game.id,
-                    game.name,
-                    None,
-                    LicenseInfo(LicenseType.SinglePurchase, None)
-                )
-            )   
+            unique_games.setdefault(game.id, game)
+        owned_games = [self._to_galaxy_game(game) for game in unique_games.values()]
+
+        if self.import_task is None or self.import_task.done():
+            self.import_task = self.create_task(self._import_games(), "Import games")
         return owned_games
-        
+
 
     async def get_local_games(self):
         loop = asyncio.get_running_loop()
-        self.local_games_cache = await loop.run_in_executor(None, self._local_games_list)
-        return self.local_games_cache
+        return await loop.run_in_executor(None, self._local_games_list)
+
+
+    async def shutdown(self):
+        self.nes_client.bulk_hasher.cancel()
+        await self.nes_client.giant_bomb.close()
+        self.nes_client.metadata.close()
+        for running_game in self.running.values():
+            # The sessions stay open and are resumed or closed on the next start
+            self.sessions.checkpoint(running_game.session_id, force=True)
+        self.game_times.compact()
 
 
 def main():
@@ -0,0 +1,133 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from galaxy.api.errors import TooManyRequests
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+DEFAULT_RETRY_AFTER = 60
+MAX_RETRIES = 3
+
+
+class TokenBucket:
+    ''' Token bucket refilled at rate tokens per second up to burst tokens
+
+    The clock is injectable so the bucket can be driven by a virtual clock.
+    '''
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+        self.blocked_until = 0.0
+
+
+    def _refill(self, now) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+    def take(self) -> float:
+        ''' Returns 0 and takes a token if one is available, otherwise the seconds until one will be'''
+        now = self.clock()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+    def pause(self, seconds) -> None:
+        ''' Returns None
+
+        Hands out no tokens for the given seconds and starts refilling from empty afterwards
+        '''
+        now = self.clock()
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = self.blocked_until
+
+
+class RateLimiter:
+    ''' Schedules requests through a token bucket, highest priority first
+
+    Requests rejected with TooManyRequests pause the whole bucket for the Retry-After time
+    carried in the error data (or DEFAULT_RETRY_AFTER) and are queued again.
+    clock and sleep are injectable to run the scheduler on a virtual clock.
+    '''
+    def __init__(self, rate, burst, clock=time.monotonic, sleep=asyncio.sleep):
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.sleep = sleep
+        self.throttled = 0
+        self._waiters = []  # heap of (priority, sequence, future)
+        self._sequence = itertools.count()
+        self._dispatcher = None
+
+
+    def configure(self, rate, burst) -> None:
+        self.bucket.rate = rate
+        self.bucket.burst = burst
+
+
+    async def run(self, request, priority=PRIORITY_NORMAL):
+        ''' Returns the result of awaiting request()
+
+        request is a callable returning a new awaitable each time, so a throttled request can be sent again
+        '''
+        for attempt in range(MAX_RETRIES + 1):
+            await self.acquire(priority)
+            try:
+                return await request()
+            except TooManyRequests as error:
+                self.throttled += 1
+                if attempt == MAX_RETRIES:
+                    raise
+                retry_after = self.retry_after(error)
+                logging.warning("DEV: Metadata requests are throttled, pausing for %s seconds", retry_after)
+                self.bucket.pause(retry_after)
+
+
+    async def acquire(self, priority=PRIORITY_NORMAL) -> None:
+        ''' Returns None once the caller may send a request'''
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+        await future
+
+
+    async def _dispatch(self) -> None:
+        while self._waiters:
+            # Drop callers that gave up before they got their turn
+            if self._waiters[0][2].done():
+                heapq.heappop(self._waiters)
+                continue
+            delay = self.bucket.take()
+            if delay > 0:
+                await self.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                # Cancelled while the token was taken, give it back
+                self.bucket.tokens += 1
+            else:
+                future.set_result(None)
+
+
+    @staticmethod
+    def retry_after(error) -> float:
+        ''' Returns the seconds to wait after a TooManyRequests error'''
+        if isinstance(error.data, dict):
+            try:
+                return max(0.0, float(error.data.get("retry_after")))
+            except (TypeError, ValueError):
+                pass
+        return DEFAULT_RETRY_AFTER
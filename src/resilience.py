@@ -0,0 +1,86 @@
+import logging
+import random
+import time
+
+from galaxy.api.errors import BackendNotAvailable
+from metrics import metrics
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 60
+BACKOFF_BASE = 1
+BACKOFF_CAP = 30
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP, rng=random) -> float:
+    ''' Returns the seconds to wait before retry number attempt (starting at 0)
+
+    Full jitter: a random delay up to the exponential backoff, so clients that failed together do not retry together
+    '''
+    return rng.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    ''' Stops calls to a backend after failure_threshold consecutive failures
+
+    While open every call is rejected with BackendNotAvailable. After reset_timeout seconds a single
+    trial call is let through (half open), its success closes the breaker and its failure opens it again.
+    The state is published as the "<name>.state" gauge, openings and rejected calls as counters.
+    '''
+    def __init__(self, name, failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_timeout=DEFAULT_RESET_TIMEOUT,
+            clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+        metrics.set(self.name + ".state", self.state)
+
+
+    def check(self) -> None:
+        ''' Returns None if a call may be made, raises BackendNotAvailable otherwise'''
+        if self.state == STATE_OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+            self._set_state(STATE_HALF_OPEN)
+        if self.state == STATE_CLOSED:
+            return
+        if self.state == STATE_HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return
+        metrics.increment(self.name + ".rejected")
+        raise BackendNotAvailable({ "circuit": self.state })
+
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._trial_running = False
+        if self.state != STATE_CLOSED:
+            self._set_state(STATE_CLOSED)
+
+
+    def release(self) -> None:
+        ''' Returns None
+
+        Lets another trial call through when a trial call ended without a result, as when it was cancelled
+        '''
+        self._trial_running = False
+
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_running = False
+        if self.state == STATE_HALF_OPEN or (self.state == STATE_CLOSED and self.failures >= self.failure_threshold):
+            self.opened_at = self.clock()
+            metrics.increment(self.name + ".opened")
+            self._set_state(STATE_OPEN)
+
+
+    def _set_state(self, state) -> None:
+        logging.debug("DEV: Circuit breaker %s is %s", self.name, state)
+        self.state = state
+        metrics.set(self.name + ".state", state)
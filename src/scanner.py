@@ -0,0 +1,132 @@
+import errno
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from archives import ARCHIVE_EXTENSIONS, list_archive, member_path
+
+ROM_EXTENSIONS = (".nes", ".fds", ".nsf", ".nsfe", ".unf")
+DEFAULT_WORKERS = 8
+# Windows errors that also map to ENOENT but mean the path is there, as an unreachable network share
+_MISSING_WINERRORS = (None, 2, 3)
+
+
+def _is_missing(error) -> bool:
+    ''' Returns True if an OSError means the path does not exist, not that it could not be reached'''
+    return error.errno == errno.ENOENT and getattr(error, "winerror", None) in _MISSING_WINERRORS
+
+
+@dataclass
+class DirListing():
+    """ DirListing object.
+
+    :param path: path to the directory
+    :param mtime: mtime of the directory when it was visited
+    :param subdirs: names of the subdirectories
+    :param roms: (name, size, mtime, crc32) of every rom in the directory, None if the directory was not listed because it did not change.
+        Roms stored in an archive are named after the archive and member, with the size and mtime of the archive and the crc32 from its directory,
+        crc32 is None for plain files
+    :param identity: (st_dev, st_ino) of the directory, None if it could not be read
+    """
+    path: str
+    mtime: float
+    subdirs: list
+    roms: Optional[list]
+    identity: Optional[tuple] = None
+
+
+class DirectoryScanner:
+    ''' Scans a directory tree for roms with os.scandir
+
+    Every directory is visited on a bounded thread pool so slow network mounts are listed concurrently,
+    listings are yielded as soon as they are available.
+    '''
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = max(1, workers)
+
+
+    def scan(self, root, known_dirs=None, full=False, dirty=()) -> Iterator[DirListing]:
+        ''' Returns an iterator of DirListing objects
+
+        known_dirs maps a directory path to [mtime, [subdir names], ...] from a previous scan,
+        directories with the same mtime are not listed again unless full is set or they are in dirty.
+        Symbolic links to directories are not followed, and a directory reached twice, as through a junction, is only listed once.
+        '''
+        known_dirs = {} if full else known_dirs or {}
+
+        def visit(path):
+            return executor.submit(self._visit, path, None if path in dirty else known_dirs.get(path))
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rom-scanner") as executor:
+            pending = { visit(root) }
+            visited = set()
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    listing = future.result()
+                    if listing is None:
+                        continue
+                    if listing.identity is not None:
+                        if listing.identity in visited:
+                            continue
+                        visited.add(listing.identity)
+                    for subdir in listing.subdirs:
+                        pending.add(visit(os.path.join(listing.path, subdir)))
+                    yield listing
+
+
+    def iter_roms(self, root) -> Iterator[str]:
+        ''' Returns an iterator of rom paths under root, in the order they are found'''
+        for listing in self.scan(root, full=True):
+            for name, _, _, _ in listing.roms:
+                yield os.path.join(listing.path, name)
+
+
+    @staticmethod
+    def _visit(path, known) -> Optional[DirListing]:
+        ''' Returns the DirListing of a directory, None if it does not exist
+
+        A directory that cannot be read, as on a network share that is briefly offline, keeps its known listing
+        '''
+        try:
+            dir_stat = os.stat(path)
+        except OSError as error:
+            if _is_missing(error) or known is None:
+                return None
+            logging.warning("DEV: Failed to read directory, keeping its known roms - %s: %r", path, error)
+            return DirListing(path, known[0], known[1], None)
+
+        mtime = dir_stat.st_mtime
+        identity = (dir_stat.st_dev, dir_stat.st_ino)
+        if known is not None and known[0] == mtime:
+            return DirListing(path, mtime, known[1], None, identity)
+
+        subdirs = []
+        roms = []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    elif entry.is_dir():
+                        # Links to directories are not followed, like os.walk
+                        continue
+                    elif entry.name.lower().endswith(ROM_EXTENSIONS):
+                        stat = entry.stat()
+                        roms.append((entry.name, stat.st_size, stat.st_mtime, None))
+                    elif entry.name.lower().endswith(ARCHIVE_EXTENSIONS):
+                        stat = entry.stat()
+                        for member, _, crc32 in list_archive(entry.path, ROM_EXTENSIONS):
+                            roms.append((member_path(entry.name, member), stat.st_size, stat.st_mtime, crc32))
+        except OSError as error:
+            logging.exception("DEV: Failed to list directory - %s", path)
+            # A rom deleted while the directory was listed does not make the directory itself missing
+            missing = _is_missing(error) and not os.path.isdir(path)
+            if known is not None and not missing:
+                return DirListing(path, known[0], known[1], None, identity)
+            # Listed again in the next scan
+            return None
+
+        return DirListing(path, mtime, subdirs, roms, identity)
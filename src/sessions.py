@@ -0,0 +1,102 @@
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from galaxy.proc_tools import get_process_info
+
+CHECKPOINT_INTERVAL = 60
+
+
+@dataclass
+class RunningGame():
+    """ RunningGame object.
+
+    :param game_id: id of the game
+    :param session_id: id of its open session in the game time store
+    :param pid: process id of the emulator running it
+    :param started: time the session started
+    :param emulator: EmulatorProcess running the game, None for a session resumed after a restart
+    """
+    game_id: str
+    session_id: str
+    pid: int
+    started: int
+    emulator: Optional[Any] = None
+
+
+def is_emulator_running(pid, emu_path) -> bool:
+    ''' Returns True if pid is a running process of the emulator at emu_path
+
+    The binary is compared as well so a reused pid is not mistaken for the emulator
+    '''
+    info = get_process_info(pid)
+    if info is None or info.binary_path is None:
+        return False
+    if not emu_path:
+        return True
+    return os.path.normcase(os.path.abspath(info.binary_path)) == os.path.normcase(os.path.abspath(emu_path))
+
+
+class SessionTracker:
+    ''' Tracks running game sessions at second resolution in a GameTimeStore
+
+    The play time of a running session is checkpointed every CHECKPOINT_INTERVAL seconds,
+    so a crash of the plugin or Galaxy loses at most one interval of it.
+    '''
+    def __init__(self, store, interval=CHECKPOINT_INTERVAL, clock=time.time):
+        self.store = store
+        self.interval = interval
+        self.clock = clock
+        self._checkpointed = {}  # session id -> time of its last checkpoint
+
+
+    def start(self, game_id, pid, emulator=None) -> RunningGame:
+        ''' Returns a new session of a game running in the emulator process pid'''
+        session_id = uuid.uuid4().hex
+        now = int(self.clock())
+        self.store.open_session(session_id, game_id, pid, now)
+        self._checkpointed[session_id] = now
+        return RunningGame(game_id, session_id, pid, now, emulator)
+
+
+    def checkpoint(self, session_id, force=False) -> Optional[dict]:
+        ''' Returns the entry of the game if a checkpoint was written, None if the interval has not passed yet'''
+        now = int(self.clock())
+        if not force and now - self._checkpointed.get(session_id, 0) < self.interval:
+            return None
+        return self._record(session_id, now, self.store.checkpoint)
+
+
+    def finish(self, session_id) -> dict:
+        ''' Returns the entry of the game after closing one of its sessions'''
+        entry = self._record(session_id, int(self.clock()), self.store.close_session)
+        self._checkpointed.pop(session_id, None)
+        return entry
+
+
+    def recover(self, is_running) -> list:
+        ''' Returns a list of RunningGame objects of sessions left open by a previous run whose emulator is still running
+
+        is_running is called with the pid of every open session. Sessions whose emulator is gone are closed
+        at their last checkpoint, as nothing is known about the time played after it.
+        '''
+        running = []
+        for session_id, session in list(self.store.sessions.items()):
+            if is_running(session["pid"]):
+                logging.debug("DEV: Resuming session of game - %s", session["id"])
+                self._checkpointed[session_id] = int(self.clock())
+                running.append(RunningGame(session["id"], session_id, session["pid"], session["started"]))
+            else:
+                logging.debug("DEV: Closing orphaned session of game - %s", session["id"])
+                self.store.close_session(session_id, 0, session["started"] + session["seconds"])
+        return running
+
+
+    def _record(self, session_id, now, record) -> dict:
+        session = self.store.sessions[session_id]
+        seconds = max(0, now - session["started"] - session["seconds"])
+        self._checkpointed[session_id] = now
+        return record(session_id, seconds, now)
@@ -0,0 +1,35 @@
+import asyncio
+
+from metrics import metrics
+
+
+class SingleFlight:
+    ''' Shares one outstanding call between every caller asking for the same key
+
+    Counts the calls that were made and the ones that were saved under "<name>.sent" and "<name>.coalesced".
+    '''
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}  # key -> future of the outstanding call
+
+
+    async def do(self, key, func):
+        ''' Returns the result of func(), or of the call already in flight for key'''
+        future = self._calls.get(key)
+        if future is not None:
+            metrics.increment(self.name + ".coalesced")
+        else:
+            metrics.increment(self.name + ".sent")
+            future = asyncio.ensure_future(func())
+            self._calls[key] = future
+            future.add_done_callback(lambda done: self._finish(key, done))
+        # A caller giving up must not cancel the call for the others
+        return await asyncio.shield(future)
+
+
+    def _finish(self, key, future) -> None:
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if not future.cancelled():
+            # Marks the exception as retrieved when every caller was cancelled
+            future.exception()
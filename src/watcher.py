@@ -0,0 +1,149 @@
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import sys
+
+POLL_INTERVAL = 1
+DEBOUNCE_DELAY = 0.2
+
+# inotify(7) event masks
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_WATCH_MASK = (_IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+    | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR)
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+class _Inotify:
+    ''' Minimal ctypes binding of inotify, one watch per directory'''
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}  # watch descriptor -> dir path
+        self._paths = {}  # dir path -> watch descriptor
+
+
+    def sync(self, dirs) -> None:
+        ''' Returns None
+
+        Adds watches for new directories and drops the ones of directories that are gone
+        '''
+        dirs = set(dirs)
+        for path in self._paths.keys() - dirs:
+            self._libc.inotify_rm_watch(self.fd, self._paths.pop(path))
+        for path in dirs - self._paths.keys():
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), _WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed for " + path)
+            self._paths[path] = wd
+            self.watches[wd] = path
+
+
+    def read_dirty(self) -> set:
+        ''' Returns the set of directories that had events, None if the kernel queue overflowed'''
+        dirty = set()
+        overflow = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                offset += _EVENT_HEADER.size + length
+                if mask & _IN_Q_OVERFLOW:
+                    overflow = True
+                elif mask & _IN_IGNORED:
+                    path = self.watches.pop(wd, None)
+                    if path is not None and self._paths.get(path) == wd:
+                        del self._paths[path]
+                elif wd in self.watches:
+                    dirty.add(self.watches[wd])
+        return None if overflow else dirty
+
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class RomWatcher:
+    ''' Watches the roms folder and reports library changes as they happen
+
+    Uses inotify on Linux and falls back to polling the incremental library index elsewhere
+    or when the directories cannot be watched.
+
+    :param rescan: blocking callable taking (full, dirty) and returning LibraryChanges
+    :param watched_dirs: callable returning the directories currently in the library index
+    :param on_changes: called on the event loop with every non-empty LibraryChanges
+    '''
+    def __init__(self, rescan, watched_dirs, on_changes, poll_interval=POLL_INTERVAL):
+        self.rescan = rescan
+        self.watched_dirs = watched_dirs
+        self.on_changes = on_changes
+        self.poll_interval = poll_interval
+        self._inotify = None
+        self._event = asyncio.Event()
+
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        if sys.platform.startswith("linux"):
+            try:
+                self._inotify = _Inotify()
+                self._inotify.sync(self.watched_dirs())
+                loop.add_reader(self._inotify.fd, self._event.set)
+                logging.debug("DEV: Watching roms folder with inotify")
+            except OSError:
+                logging.exception("DEV: Failed to set up inotify, polling the roms folder instead")
+                self._close_inotify()
+
+        try:
+            while True:
+                if self._inotify is None:
+                    await asyncio.sleep(self.poll_interval)
+                    changes = await loop.run_in_executor(None, self.rescan, False, ())
+                else:
+                    await self._event.wait()
+                    await asyncio.sleep(DEBOUNCE_DELAY)
+                    self._event.clear()
+                    dirty = self._inotify.read_dirty()
+                    changes = await loop.run_in_executor(None, self.rescan, dirty is None, dirty or ())
+                    self._sync_watches()
+
+                if changes:
+                    self.on_changes(changes)
+        finally:
+            self._close_inotify()
+
+
+    def _sync_watches(self) -> None:
+        try:
+            self._inotify.sync(self.watched_dirs())
+        except OSError:
+            logging.exception("DEV: Failed to watch new directories, polling the roms folder instead")
+            self._close_inotify()
+
+
+    def _close_inotify(self) -> None:
+        if self._inotify is None:
+            return
+        try:
+            asyncio.get_running_loop().remove_reader(self._inotify.fd)
+        except RuntimeError:
+            pass
+        self._inotify.close()
+        self._inotify = None
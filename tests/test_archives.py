@@ -0,0 +1,99 @@
+import os
+import struct
+import zipfile
+
+import pytest
+
+from archives import ExtractCache, list_archive, member_path, open_rom, split_member
+from hashing import hash_rom
+
+ROM = b"NES\x1a\x02\x01" + b"\0" * 10 + bytes(range(256)) * 128
+
+
+def write_zip(path, members):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+
+
+def corrupt_member(path, name):
+    # A reserved deflate block type, inflating the member fails with zlib.error
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(name)
+    with open(path, "r+b") as data:
+        data.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack("<HH", data.read(4))
+        data.seek(info.header_offset + 30 + name_length + extra_length)
+        data.write(b"\x07")
+
+
+@pytest.fixture
+def archive(tmp_path):
+    path = str(tmp_path / "roms.zip")
+    write_zip(path, { "Zelda.nes": ROM, "readme.txt": b"text", "sub/Metroid.nes": ROM[:1024] })
+    return path
+
+
+def test_member_paths_round_trip(archive):
+    path = member_path(archive, "sub/Metroid.nes")
+    assert split_member(path) == (archive, "sub/Metroid.nes")
+    assert split_member(archive) == (archive, None)
+
+
+def test_list_archive_only_lists_roms(archive):
+    assert sorted(list_archive(archive, (".nes",))) == [
+        ("Zelda.nes", len(ROM), "%08x" % zipfile.crc32(ROM)),
+        ("sub/Metroid.nes", 1024, "%08x" % zipfile.crc32(ROM[:1024])),
+    ]
+
+
+def test_list_archive_of_a_broken_file_is_empty(tmp_path):
+    path = str(tmp_path / "broken.zip")
+    with open(path, "wb") as data:
+        data.write(b"PK not really a zip")
+    assert list_archive(path, (".nes",)) == []
+
+
+def test_open_rom_reads_plain_files_and_members(archive, tmp_path):
+    plain = str(tmp_path / "Zelda.nes")
+    with open(plain, "wb") as data:
+        data.write(ROM)
+
+    with open_rom(plain) as (rom, size):
+        assert (rom.read(), size) == (ROM, len(ROM))
+    with open_rom(member_path(archive, "Zelda.nes")) as (rom, size):
+        assert (rom.read(), size) == (ROM, len(ROM))
+
+
+def test_missing_member_is_an_os_error(archive):
+    with pytest.raises(OSError):
+        with open_rom(member_path(archive, "Kirby.nes")):
+            pass
+
+
+def test_corrupted_member_is_an_os_error(archive):
+    corrupt_member(archive, "Zelda.nes")
+    path = member_path(archive, "Zelda.nes")
+    with pytest.raises(OSError):
+        with open_rom(path) as (rom, _):
+            rom.read()
+    with pytest.raises(OSError):
+        hash_rom(path)
+
+    # The other members of the archive are still readable
+    with open_rom(member_path(archive, "sub/Metroid.nes")) as (rom, _):
+        assert rom.read() == ROM[:1024]
+
+
+def test_extract_cache_evicts_the_oldest_roms(archive, tmp_path):
+    cache = ExtractCache(str(tmp_path / "extracted"), max_bytes=len(ROM) + 1024)
+    zelda = cache.extract(member_path(archive, "Zelda.nes"), "00000001")
+    metroid = cache.extract(member_path(archive, "sub/Metroid.nes"), "00000002")
+    os.utime(zelda, (1000, 1000))
+    with open(zelda, "rb") as data:
+        assert data.read() == ROM
+    assert cache.extract(member_path(archive, "sub/Metroid.nes"), "00000002") == metroid
+
+    cache.extract(member_path(archive, "Zelda.nes"), "00000003")
+    assert not os.path.exists(zelda)
+    assert os.path.exists(metroid)
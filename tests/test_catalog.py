@@ -0,0 +1,94 @@
+import json
+
+import pytest
+
+from catalog import RETRY_INTERVAL, PlatformCatalog, TitleMatcher, edit_distance, trigrams
+
+GAMES = [
+    { "id": 1, "name": "The Legend of Zelda", "aliases": ["Zelda no Densetsu"] },
+    { "id": 2, "name": "Zelda II: The Adventure of Link", "aliases": [] },
+    { "id": 3, "name": "Contra", "aliases": ["Probotector"] },
+    { "id": 4, "name": "Super Contra", "aliases": None },
+    { "id": 5, "name": "Mega Man 2", "aliases": ["Rockman 2"] },
+]
+
+
+def test_edit_distance_and_trigrams():
+    assert edit_distance("contra", "contra") == 0
+    assert edit_distance("kitten", "sitting") == 3
+    assert edit_distance("", "abc") == 3
+    assert trigrams("ab") == {"  a", " ab", "ab "}
+
+
+@pytest.fixture
+def matcher():
+    return TitleMatcher(GAMES)
+
+
+def test_exact_names_and_aliases(matcher):
+    assert matcher.match("the legend of zelda")["id"] == 1
+    assert matcher.match("Probotector")["id"] == 3
+    assert matcher.match("Rockman 2")["id"] == 5
+
+
+def test_close_titles_match_the_nearest_game(matcher):
+    assert matcher.match("Zelda II - The Adventure of Link")["id"] == 2
+    assert matcher.match("Megaman 2")["id"] == 5
+    assert matcher.match("Contra!")["id"] == 3
+    assert matcher.match("Super Contra.")["id"] == 4
+
+
+def test_unrelated_titles_do_not_match(matcher):
+    assert matcher.match("Battletoads") is None
+    assert matcher.match("!!!") is None
+    assert TitleMatcher().match("Contra") is None
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000000.0
+
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def test_catalog_is_stored_and_loaded(tmp_path, clock):
+    path = str(tmp_path / "data" / "catalog.json")
+    catalog = PlatformCatalog(path, max_age=100, clock=clock)
+    catalog.load()
+    assert catalog.needs_refresh()
+    catalog.replace(GAMES)
+    assert catalog.match("Zelda no Densetsu") == { "id": 1, "name": "The Legend of Zelda" }
+
+    loaded = PlatformCatalog(path, max_age=100, clock=clock)
+    loaded.load()
+    assert loaded.fetched_at == clock.now
+    assert loaded.match("Contra") == { "id": 3, "name": "Contra" }
+    assert not loaded.needs_refresh()
+    clock.now += 101
+    assert loaded.needs_refresh()
+
+
+def test_failed_download_is_not_retried_right_away(tmp_path, clock):
+    catalog = PlatformCatalog(str(tmp_path / "catalog.json"), clock=clock)
+    catalog.load()
+    catalog.attempted_at = clock.now
+    assert not catalog.needs_refresh()
+    clock.now += RETRY_INTERVAL
+    assert catalog.needs_refresh()
+
+
+@pytest.mark.parametrize("content", ["{ broken", json.dumps({ "version": 0, "games": GAMES, "fetched_at": 1 })])
+def test_unreadable_catalog_is_empty(tmp_path, clock, content):
+    path = tmp_path / "catalog.json"
+    path.write_text(content)
+    catalog = PlatformCatalog(str(path), clock=clock)
+    catalog.load()
+    assert catalog.games == []
+    assert catalog.needs_refresh()
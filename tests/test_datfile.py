@@ -0,0 +1,79 @@
+import hashlib
+import os
+import zlib
+
+import pytest
+
+from datfile import DatIndex, dat_game_id, dat_title
+from hashing import RomHash
+
+CONTRA_USA = b"\x01" * 1024
+CONTRA_EUROPE = b"\x02" * 1024
+ZELDA = b"\x03" * 1024
+
+
+def rom_hash(data) -> RomHash:
+    return RomHash("%08x" % zlib.crc32(data), hashlib.sha1(data).hexdigest())
+
+
+def rom_entry(name, data, sha1=True) -> str:
+    sha1 = ' sha1="{}"'.format(hashlib.sha1(data).hexdigest()) if sha1 else ""
+    return '<game name="{0}"><rom name="{0}.nes" crc="{1:08X}"{2}/></game>'.format(name, zlib.crc32(data), sha1)
+
+
+@pytest.fixture
+def dat_dir(tmp_path):
+    path = tmp_path / "dats"
+    path.mkdir()
+    (path / "Nintendo - NES.dat").write_text('<?xml version="1.0"?><datafile>{}{}{}</datafile>'.format(
+        rom_entry("Contra (USA)", CONTRA_USA), rom_entry("Contra (Europe)", CONTRA_EUROPE),
+        rom_entry("Legend of Zelda, The (USA) (Rev 1)", ZELDA, sha1=False)))
+    (path / "broken.dat").write_text("<datafile><game")
+    (path / "readme.txt").write_text("not a dat")
+    return str(path)
+
+
+@pytest.fixture
+def index(tmp_path):
+    return DatIndex(str(tmp_path / "data" / "dat_index.bin"))
+
+
+def test_titles_drop_region_and_dump_tags():
+    assert dat_title("Contra (USA)") == "Contra"
+    assert dat_title("Legend of Zelda, The (USA) (Rev 1)") == "The Legend of Zelda"
+
+
+def test_dumps_of_a_game_share_its_id():
+    assert dat_game_id("Contra") == dat_game_id("contra")
+    assert dat_game_id(dat_title("Contra (USA)")) == dat_game_id(dat_title("Contra (Europe)"))
+    assert dat_game_id("Contra") != dat_game_id("Super Contra")
+
+
+def test_lookup_by_sha1_or_crc32(dat_dir, index):
+    index.load(dat_dir)
+    assert index.lookup(rom_hash(CONTRA_USA)) == "Contra"
+    assert index.lookup(rom_hash(CONTRA_EUROPE)) == "Contra"
+    assert index.lookup(RomHash(rom_hash(ZELDA).crc32, None)) == "The Legend of Zelda"
+    assert index.lookup(rom_hash(b"unknown")) is None
+    assert len(index.titles) == 2
+
+
+def test_snapshot_is_used_until_a_dat_changes(dat_dir, index):
+    index.load(dat_dir)
+    reloaded = DatIndex(index.snapshot_path)
+    reloaded._parse = None  # The snapshot is up to date, no DAT file may be parsed
+    reloaded.load(dat_dir)
+    assert reloaded.lookup(rom_hash(CONTRA_USA)) == "Contra"
+
+    dat_path = os.path.join(dat_dir, "Nintendo - NES.dat")
+    os.utime(dat_path, (1000, 1000))
+    changed = DatIndex(index.snapshot_path)
+    changed.load(dat_dir)
+    assert changed.lookup(rom_hash(CONTRA_USA)) == "Contra"
+
+
+def test_missing_dat_folder_is_empty(index, tmp_path):
+    index.load(str(tmp_path / "missing"))
+    assert index.lookup(rom_hash(CONTRA_USA)) is None
+    index.load(None)
+    assert index.titles == []
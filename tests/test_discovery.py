@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+pytest.importorskip("psutil")
+
+from archives import member_path  # noqa: E402
+from definitions import NESGame  # noqa: E402
+from discovery import PathIndex, ProcessDiscovery  # noqa: E402
+
+
+@pytest.fixture
+def games(tmp_path):
+    archive = str(tmp_path / "roms.zip")
+    return [
+        NESGame("1", "Zelda", str(tmp_path / "Zelda.nes")),
+        NESGame("2", "Metroid", member_path(archive, "Metroid.nes")),
+        NESGame("3", "Kirby", member_path(str(tmp_path / "gone.zip"), "Kirby.nes")),
+    ]
+
+
+def test_path_index_finds_plain_roms_archives_and_extracted_roms(games, tmp_path):
+    roms = { games[0].path: [1, 1.0, None], games[1].path: [2, 1.0, "0000abcd"] }
+    # Kirby was deleted, the watcher dropped it from the library before its game was removed
+    index = PathIndex(games, roms, str(tmp_path / "extracted"))
+
+    assert index.find(["-v", str(tmp_path / "Zelda.nes")]) == "1"
+    assert index.find([str(tmp_path / "roms.zip")]) == "2"
+    assert index.find([str(tmp_path / "extracted" / "0000abcd_Metroid.nes")]) == "2"
+    assert index.find([str(tmp_path / "gone.zip")]) is None
+    assert index.find(["Zelda.nes"]) is None
+
+
+def test_discovery_reports_started_and_stopped_emulators(games, tmp_path):
+    index = PathIndex(games[:1], { games[0].path: [1, 1.0, None] }, str(tmp_path))
+    pids = [10, 11]
+    cmdlines = { 10: ["/usr/bin/mono", "/opt/Mesen.exe", games[0].path], 11: [], 12: ["/bin/sh"] }
+    discovery = ProcessDiscovery(lambda: pids, cmdlines.get)
+
+    assert discovery.scan("C:/Mesen/Mesen.exe", index) == ({ 10: "1" }, [])
+    # 11 had no command line yet and is read once more
+    cmdlines[11] = [os.path.join("/opt", "Mesen.exe"), games[0].path]
+    assert discovery.scan("C:/Mesen/Mesen.exe", index) == ({ 11: "1" }, [])
+
+    pids[:] = [12]
+    started, stopped = discovery.scan("C:/Mesen/Mesen.exe", index)
+    assert started == {}
+    assert sorted(stopped) == [10, 11]
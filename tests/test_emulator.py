@@ -0,0 +1,45 @@
+import asyncio
+import sys
+
+import pytest
+
+from emulator import LaunchError, launch
+
+
+def python(code):
+    return [sys.executable, "-c", code]
+
+
+def test_emulator_that_keeps_running_is_launched():
+    async def main():
+        pids = []
+        emulator = await launch(python("import time; time.sleep(0.5)"), 0.1, pids.append)
+        assert pids == [emulator.pid]
+        assert await emulator.wait() == 0
+
+    asyncio.run(main())
+
+
+def test_early_exit_with_an_error_fails_the_launch():
+    async def main():
+        with pytest.raises(LaunchError, match="no rom"):
+            await launch(python("import sys; sys.exit('no rom')"), 5)
+
+    asyncio.run(main())
+
+
+def test_early_exit_without_an_error_is_a_launch():
+    async def main():
+        emulator = await launch(python("import sys; print('handed over', file=sys.stderr)"), 5)
+        assert await emulator.wait() == 0
+        assert emulator.stderr_tail() == "handed over"
+
+    asyncio.run(main())
+
+
+def test_missing_emulator_fails_the_launch(tmp_path):
+    async def main():
+        with pytest.raises(LaunchError):
+            await launch([str(tmp_path / "Mesen.exe")], 5)
+
+    asyncio.run(main())
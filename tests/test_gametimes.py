@@ -0,0 +1,91 @@
+import os
+
+import pytest
+
+from gametimes import GameTimeStore
+
+
+@pytest.fixture
+def paths(tmp_path):
+    return str(tmp_path / "game_times.json"), str(tmp_path / "game_times.journal")
+
+
+def play(store, session_id, game_id, seconds, now):
+    store.open_session(session_id, game_id, 1234, now)
+    store.close_session(session_id, seconds, now + seconds)
+
+
+def test_torn_journal_line_is_dropped(paths):
+    store = GameTimeStore(*paths)
+    play(store, "a", "game", 90, 1000)
+    with open(paths[1], "ab") as journal:
+        journal.write(b'{"type": "close", "session": "b", "id": "ga')
+
+    store = GameTimeStore(*paths)
+    assert store.get("game")["seconds_played"] == 90
+    assert store.get("game")["time_played"] == 1
+    with open(paths[1], "rb") as journal:
+        assert journal.read().endswith(b"}\n")
+
+    # The next entry starts on a line of its own and survives another reload
+    play(store, "c", "game", 30, 2000)
+    store = GameTimeStore(*paths)
+    assert store.get("game")["seconds_played"] == 120
+    assert store.get("game")["last_time_played"] == 2030
+
+
+def test_unreadable_journal_line_is_skipped(paths):
+    store = GameTimeStore(*paths)
+    play(store, "a", "game", 60, 1000)
+    with open(paths[1], "ab") as journal:
+        journal.write(b"not json\n")
+    play(store, "b", "game", 60, 2000)
+
+    store = GameTimeStore(*paths)
+    assert store.get("game")["seconds_played"] == 120
+
+
+def test_journal_left_by_an_interrupted_compaction_is_not_counted_twice(paths):
+    store = GameTimeStore(*paths)
+    play(store, "a", "game", 120, 1000)
+    with open(paths[1], "rb") as journal:
+        entries = journal.read()
+
+    # The snapshot was replaced but the journal was not truncated yet
+    store.compact()
+    with open(paths[1], "wb") as journal:
+        journal.write(entries)
+
+    store = GameTimeStore(*paths)
+    assert store.get("game")["seconds_played"] == 120
+    play(store, "b", "game", 60, 2000)
+    store = GameTimeStore(*paths)
+    assert store.get("game")["seconds_played"] == 180
+
+
+def test_snapshot_written_half_way_is_ignored(paths):
+    store = GameTimeStore(*paths)
+    play(store, "a", "game", 60, 1000)
+    store.compact()
+    play(store, "b", "game", 60, 2000)
+    # The crash happened before the new snapshot replaced the old one
+    with open(paths[0] + ".tmp", "w", encoding="utf-8") as snapshot:
+        snapshot.write('{"version": 3, "sequ')
+
+    store = GameTimeStore(*paths)
+    assert store.get("game")["seconds_played"] == 120
+    store.compact()
+    assert not os.path.exists(paths[0] + ".tmp")
+    assert GameTimeStore(*paths).get("game")["seconds_played"] == 120
+
+
+def test_open_session_survives_a_restart(paths):
+    store = GameTimeStore(*paths)
+    store.open_session("a", "game", 1234, 1000)
+    store.checkpoint("a", 60, 1060)
+
+    store = GameTimeStore(*paths)
+    assert store.sessions["a"]["seconds"] == 60
+    store.close_session("a", 30, 1090)
+    assert store.get("game")["seconds_played"] == 90
+    assert store.sessions == {}
@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from aiohttp import web  # noqa: E402
+
+import giantbomb  # noqa: E402
+from galaxy.api.errors import InvalidCredentials, TooManyRequests  # noqa: E402
+from giantbomb import GiantBombClient, check_response  # noqa: E402
+from ratelimit import DEFAULT_RETRY_AFTER, RateLimiter  # noqa: E402
+
+
+class VirtualClock:
+    ''' A clock that only moves when the rate limiter sleeps, requests to the stub server take no time on it'''
+    def __init__(self):
+        self.now = 0.0
+
+
+    def __call__(self) -> float:
+        return self.now
+
+
+    async def sleep(self, seconds) -> None:
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+class StubServer:
+    ''' Local Giant Bomb search endpoint answering with the queued responses, then with a result'''
+    def __init__(self, clock):
+        self.clock = clock
+        self.responses = []
+        self.requests = []
+
+
+    async def search(self, request):
+        self.requests.append((self.clock.now, dict(request.query)))
+        if self.responses:
+            return self.responses.pop(0)
+        return web.json_response({ "status_code": 1, "results": [{ "id": 7, "name": request.query["query"] }] })
+
+
+def run_against_stub(test):
+    clock = VirtualClock()
+    server = StubServer(clock)
+
+    async def main():
+        app = web.Application()
+        app.router.add_get("/api/search/", server.search)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        client = GiantBombClient(rate_limiter=RateLimiter(1, 5, clock, clock.sleep))
+        search_url = giantbomb.SEARCH_URL
+        giantbomb.SEARCH_URL = "http://127.0.0.1:{}/api/search/".format(port)
+        try:
+            await test(client, server, clock)
+        finally:
+            giantbomb.SEARCH_URL = search_url
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(main())
+
+
+def test_search_sends_the_query():
+    async def test(client, server, clock):
+        assert await client.search("key", "Contra") == { "id": 7, "name": "Contra" }
+        _, query = server.requests[0]
+        assert (query["api_key"], query["query"], query["resources"]) == ("key", "Contra", "game")
+
+    run_against_stub(test)
+
+
+@pytest.mark.parametrize("status", [420, 429])
+def test_throttling_status_pauses_for_retry_after(status):
+    async def test(client, server, clock):
+        server.responses.append(web.Response(status=status, headers={ "Retry-After": "30" }))
+        assert await client.search("key", "Contra") == { "id": 7, "name": "Contra" }
+        assert server.requests[0][0] == 0
+        assert server.requests[1][0] >= 30
+        assert client.rate_limiter.throttled == 1
+        assert client.breaker.failures == 0
+
+    run_against_stub(test)
+
+
+def test_rate_limited_status_code_pauses_for_retry_after():
+    async def test(client, server, clock):
+        server.responses.append(web.json_response({ "status_code": 107, "error": "Rate limit exceeded" },
+            headers={ "Retry-After": "45" }))
+        assert await client.search("key", "Contra") == { "id": 7, "name": "Contra" }
+        assert 45 <= server.requests[1][0] < DEFAULT_RETRY_AFTER
+
+    run_against_stub(test)
+
+
+def test_rate_limited_without_retry_after_waits_the_default():
+    async def test(client, server, clock):
+        server.responses.append(web.json_response({ "status_code": 107, "error": "Rate limit exceeded" }))
+        await client.search("key", "Contra")
+        assert server.requests[1][0] >= DEFAULT_RETRY_AFTER
+
+    run_against_stub(test)
+
+
+def test_throttled_too_often_raises():
+    async def test(client, server, clock):
+        server.responses.extend(web.Response(status=420) for _ in range(4))
+        with pytest.raises(TooManyRequests):
+            await client.search("key", "Contra")
+        assert len(server.requests) == 4
+
+    run_against_stub(test)
+
+
+def test_invalid_api_key():
+    async def test(client, server, clock):
+        server.responses.append(web.json_response({ "status_code": 100, "error": "Invalid API Key" }))
+        with pytest.raises(InvalidCredentials):
+            await client.search("key", "Contra")
+        with pytest.raises(InvalidCredentials):
+            await client.search("", "Contra")
+
+    run_against_stub(test)
+
+
+def test_check_response_reads_retry_after():
+    with pytest.raises(TooManyRequests) as error:
+        check_response({ "status_code": 107 }, { "Retry-After": "12" })
+    assert RateLimiter.retry_after(error.value) == 12
@@ -0,0 +1,96 @@
+import os
+import zipfile
+
+import pytest
+
+from archives import member_path
+from headers import (FLAG_BATTERY, FLAG_HEADER, KIND_FDS, KIND_HEADERLESS, KIND_INES, KIND_NES20, KIND_NSF,
+                     REGION_PAL, FDS_SIDE_SIZE, HeaderIndex, RomHeader, header_tags, parse_header)
+
+
+def ines(prg_banks=2, chr_banks=1, flags6=0, flags7=0, flags9=0):
+    header = b"NES\x1a" + bytes([prg_banks, chr_banks, flags6, flags7, 0, flags9]) + b"\0" * 6
+    return header + b"\xff" * ((prg_banks * 16 + chr_banks * 8) * 1024)
+
+
+def write(path, data):
+    with open(path, "wb") as rom:
+        rom.write(data)
+    return path
+
+
+def test_ines_header():
+    data = ines(flags6=0x12, flags9=0x01)
+    header = parse_header(data, len(data))
+    assert header == RomHeader(KIND_INES, mapper=1, prg_kb=32, chr_kb=8, region=REGION_PAL,
+        flags=FLAG_BATTERY | FLAG_HEADER)
+    assert header_tags(header) == ["iNES", "PAL", "Mapper 1", "Battery save"]
+
+
+def test_nes20_header():
+    data = ines(flags7=0x08)
+    assert parse_header(data, len(data)).kind == KIND_NES20
+
+
+def test_truncated_dump_is_invalid():
+    data = ines()
+    assert parse_header(data, len(data) - 1) is None
+    assert parse_header(ines(prg_banks=0), 16) is None
+
+
+def test_fds_and_nsf_headers():
+    fds = b"FDS\x1a\x02" + b"\0" * 11
+    assert parse_header(fds, 16 + 2 * FDS_SIDE_SIZE) == RomHeader(KIND_FDS, prg_kb=2, region=0, flags=FLAG_HEADER)
+    assert parse_header(fds, 16 + FDS_SIDE_SIZE) is None
+
+    nsf = bytearray(0x80)
+    nsf[:5] = b"NESM\x1a"
+    nsf[6] = 12
+    header = parse_header(bytes(nsf), 0x1000)
+    assert (header.kind, header.songs) == (KIND_NSF, 12)
+
+
+def test_unrecognised_data_is_headerless():
+    header = parse_header(b"\x78\xd8\xa9\x10" + b"\0" * 124, 40976)
+    assert header == RomHeader(KIND_HEADERLESS)
+    assert header_tags(header) == ["Headerless"]
+    assert parse_header(b"", 0) is None
+
+
+@pytest.fixture
+def index(tmp_path):
+    return HeaderIndex(str(tmp_path / "data" / "headers.json"))
+
+
+def test_headerless_nes_dumps_are_valid(index, tmp_path):
+    plain = write(str(tmp_path / "Zelda (USA).nes"), b"\x78\xd8" * 0x5000)
+    archive = str(tmp_path / "roms.zip")
+    with zipfile.ZipFile(archive, "w") as roms:
+        roms.writestr("Metroid (USA).nes", b"\x78\xd8" * 0x5000)
+    disk = write(str(tmp_path / "Broken.fds"), b"\0" * FDS_SIDE_SIZE)
+
+    for path in (plain, member_path(archive, "Metroid (USA).nes"), disk):
+        index.update(path, os.path.getsize(path.split("|")[0]), 1.0)
+    assert index.is_valid(plain)
+    assert index.get(plain) == RomHeader(KIND_HEADERLESS)
+    assert index.is_valid(member_path(archive, "Metroid (USA).nes"))
+    assert not index.is_valid(disk)
+
+
+def test_index_is_kept_and_reloaded(index, tmp_path):
+    zelda = write(str(tmp_path / "Zelda.nes"), ines(flags6=0x40))
+    truncated = write(str(tmp_path / "Truncated.nes"), ines()[:1024])
+    index.update(zelda, 1, 1.0)
+    index.update(truncated, 2, 1.0)
+    assert not index.is_valid(truncated)
+    assert index.filter(mapper=4) == [zelda]
+    index.save()
+
+    reloaded = HeaderIndex(index.path)
+    assert reloaded.get(zelda) == index.get(zelda)
+    assert reloaded.has_header(zelda)
+
+    reloaded.remove([zelda])
+    assert reloaded.get(zelda) is None
+    assert reloaded.paths == [truncated]
+    assert reloaded.rows == {truncated: 0}
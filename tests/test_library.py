@@ -0,0 +1,105 @@
+import os
+
+import pytest
+
+from library import LibraryIndex
+from scanner import DirectoryScanner
+
+
+def write_rom(path, size=16):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as rom:
+        rom.write(b"\0" * size)
+
+
+def touch_dir(path, mtime):
+    # A second listing in the same clock tick would not see a new directory mtime
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def roms(tmp_path):
+    root = tmp_path / "roms"
+    write_rom(str(root / "Zelda.nes"))
+    write_rom(str(root / "sub" / "Metroid.nes"))
+    write_rom(str(root / "sub" / "notes.txt"))
+    touch_dir(str(root), 1000)
+    touch_dir(str(root / "sub"), 1000)
+    return str(root)
+
+
+@pytest.fixture
+def index(tmp_path):
+    return LibraryIndex(str(tmp_path / "data" / "library.json"), DirectoryScanner(workers=2))
+
+
+def test_first_scan_adds_every_rom(roms, index):
+    changes = index.rescan(roms)
+    assert sorted(changes.added) == [os.path.join(roms, "Zelda.nes"), os.path.join(roms, "sub", "Metroid.nes")]
+    assert changes.removed == []
+    assert changes.modified == []
+    assert not index.rescan(roms)
+
+
+def test_added_and_removed_roms(roms, index):
+    index.rescan(roms)
+    write_rom(os.path.join(roms, "sub", "Kirby.nes"))
+    os.remove(os.path.join(roms, "Zelda.nes"))
+    touch_dir(roms, 2000)
+    touch_dir(os.path.join(roms, "sub"), 2000)
+
+    changes = index.rescan(roms)
+    assert changes.added == [os.path.join(roms, "sub", "Kirby.nes")]
+    assert changes.removed == [os.path.join(roms, "Zelda.nes")]
+    assert changes.modified == []
+
+
+def test_removed_directory_removes_its_roms(roms, index):
+    index.rescan(roms)
+    os.remove(os.path.join(roms, "sub", "Metroid.nes"))
+    os.remove(os.path.join(roms, "sub", "notes.txt"))
+    os.rmdir(os.path.join(roms, "sub"))
+    touch_dir(roms, 2000)
+
+    changes = index.rescan(roms)
+    assert changes.removed == [os.path.join(roms, "sub", "Metroid.nes")]
+    assert changes.added == []
+
+
+def test_rom_rewritten_in_place_needs_a_dirty_directory(roms, index):
+    index.rescan(roms)
+    rom_path = os.path.join(roms, "sub", "Metroid.nes")
+    write_rom(rom_path, size=32)
+    touch_dir(os.path.join(roms, "sub"), 1000)
+
+    assert not index.rescan(roms)
+    assert index.rescan(roms, dirty=(os.path.join(roms, "sub"),)).modified == [rom_path]
+    assert index.roms[rom_path][0] == 32
+
+
+def test_full_rescan_lists_unchanged_directories(roms, index):
+    index.rescan(roms)
+    rom_path = os.path.join(roms, "Zelda.nes")
+    write_rom(rom_path, size=32)
+    touch_dir(roms, 1000)
+
+    assert index.rescan(roms, full=True).modified == [rom_path]
+
+
+def test_new_root_replaces_the_library(roms, index, tmp_path):
+    index.rescan(roms)
+    other = str(tmp_path / "other")
+    write_rom(os.path.join(other, "Contra.nes"))
+
+    changes = index.rescan(other)
+    assert changes.added == [os.path.join(other, "Contra.nes")]
+    assert sorted(changes.removed) == [os.path.join(roms, "Zelda.nes"), os.path.join(roms, "sub", "Metroid.nes")]
+
+
+def test_index_is_reloaded_from_disk(roms, index, tmp_path):
+    index.rescan(roms)
+    index.save()
+
+    reloaded = LibraryIndex(index.path, DirectoryScanner(workers=2))
+    assert reloaded.roms == index.roms
+    assert not reloaded.rescan(roms)
@@ -0,0 +1,42 @@
+import pytest
+
+from normalize import parse_rom_name, title_key
+
+
+@pytest.mark.parametrize("names", [
+    ("Legend of Zelda, The (U) (PRG1) [!]", "The Legend of Zelda (USA) (Rev 1)", "legend of zelda, the (E)"),
+    ("Super Mario Bros. (W) [!]", "Super Mario Bros (JU) [b1]", "Super  Mario  Bros. (Europe)"),
+    ("Final Fantasy (J) [T+Eng1.0]", "Final Fantasy (USA)", "Final Fantasy"),
+])
+def test_releases_of_a_game_share_its_key(names):
+    assert len({parse_rom_name(name).key for name in names}) == 1
+
+
+def test_goodnes_tags():
+    name = parse_rom_name("Legend of Zelda, The (U) (PRG1) [!]")
+    assert name.title == "The Legend of Zelda"
+    assert name.regions == ("USA",)
+    assert name.revision == "1"
+    assert name.flags == ("verified",)
+
+    assert parse_rom_name("Super Mario Bros (JU) [b1]").regions == ("Japan", "USA")
+    assert parse_rom_name("Super Mario Bros (JU) [b1]").flags == ("bad dump",)
+    assert parse_rom_name("Castlevania (E) [hM04]").hack
+    assert parse_rom_name("Final Fantasy (J) [T+Eng1.0]").translation
+
+
+def test_no_intro_tags():
+    name = parse_rom_name("Tetris (En,Fr,De) (Beta)")
+    assert name.title == "Tetris"
+    assert name.languages == ("En", "Fr", "De")
+    assert name.tags == ("Beta",)
+    assert parse_rom_name("The Legend of Zelda (USA) (Rev 1)").revision == "1"
+
+
+def test_title_key():
+    assert title_key("Pokemon & Friends") == "pokemon and friends"
+    assert title_key("Kirby's  Adventure!") == "kirbys adventure"
+
+
+def test_name_of_only_tags_keeps_them_as_title():
+    assert parse_rom_name("(Unl)").title == "(Unl)"
@@ -0,0 +1,68 @@
+import asyncio
+
+from galaxy.api.errors import TooManyRequests
+from ratelimit import DEFAULT_RETRY_AFTER, PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL, RateLimiter
+
+
+class VirtualClock:
+    ''' A clock that only moves when the rate limiter sleeps'''
+    def __init__(self):
+        self.now = 0.0
+
+
+    def __call__(self) -> float:
+        return self.now
+
+
+    async def sleep(self, seconds) -> None:
+        self.now += seconds
+        await asyncio.sleep(0)
+
+
+def test_waiters_are_served_highest_priority_first():
+    clock = VirtualClock()
+    limiter = RateLimiter(1, 1, clock, clock.sleep)
+    order = []
+
+    async def request(name, priority):
+        await limiter.acquire(priority)
+        order.append(name)
+
+    # The only token is gone, so every caller is queued before the first one is let through
+    assert limiter.bucket.take() == 0
+
+    async def main():
+        await asyncio.gather(
+            request("low", PRIORITY_LOW),
+            request("normal", PRIORITY_NORMAL),
+            request("high", PRIORITY_HIGH),
+            request("second high", PRIORITY_HIGH),
+        )
+
+    asyncio.run(main())
+    assert order == ["high", "second high", "normal", "low"]
+    assert clock.now == 4
+
+
+def test_retry_after_pauses_the_bucket():
+    clock = VirtualClock()
+    limiter = RateLimiter(1, 5, clock, clock.sleep)
+    attempts = []
+
+    async def request():
+        attempts.append(clock.now)
+        if len(attempts) == 1:
+            raise TooManyRequests({ "retry_after": 30 })
+        return "ok"
+
+    assert asyncio.run(limiter.run(request)) == "ok"
+    assert limiter.throttled == 1
+    assert attempts[0] == 0
+    # The burst left in the bucket is not used while it is paused
+    assert attempts[1] >= 30
+
+
+def test_retry_after_falls_back_to_the_default():
+    assert RateLimiter.retry_after(TooManyRequests({ "retry_after": "12" })) == 12
+    assert RateLimiter.retry_after(TooManyRequests({ "retry_after": "soon" })) == DEFAULT_RETRY_AFTER
+    assert RateLimiter.retry_after(TooManyRequests()) == DEFAULT_RETRY_AFTER
@@ -0,0 +1,84 @@
+import pytest
+
+from galaxy.api.errors import BackendNotAvailable
+from metrics import metrics
+from resilience import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return VirtualClock()
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("test_breaker", failure_threshold=3, reset_timeout=10, clock=clock)
+
+
+def test_opens_after_consecutive_failures(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == STATE_CLOSED
+    breaker.check()
+
+    breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+    assert metrics.gauges["test_breaker.state"] == STATE_OPEN
+    with pytest.raises(BackendNotAvailable):
+        breaker.check()
+
+
+def test_half_open_lets_a_single_trial_through(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now = 9.9
+    with pytest.raises(BackendNotAvailable):
+        breaker.check()
+
+    clock.now = 10
+    breaker.check()
+    assert breaker.state == STATE_HALF_OPEN
+    with pytest.raises(BackendNotAvailable):
+        breaker.check()
+
+    # A trial that ended without a result lets the next one through
+    breaker.release()
+    breaker.check()
+
+
+def test_failed_trial_opens_again(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now = 10
+    breaker.check()
+    breaker.record_failure()
+    assert breaker.state == STATE_OPEN
+    assert breaker.opened_at == 10
+
+    clock.now = 15
+    with pytest.raises(BackendNotAvailable):
+        breaker.check()
+
+
+def test_successful_trial_closes(breaker, clock):
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now = 10
+    breaker.check()
+    breaker.record_success()
+    assert breaker.state == STATE_CLOSED
+    assert breaker.failures == 0
+    breaker.check()
+    breaker.check()